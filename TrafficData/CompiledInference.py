@@ -0,0 +1,63 @@
+import string
+import threading
+import numpy as np
+import tensorflow as tf
+
+BATCH_BUCKETS = (1, 4, 16, 64, 256) # batch sizes a model is traced for, inputs are padded up to the next one
+
+# a keras model called through traced tf.functions with fixed input signatures instead of model.predict
+# predict sets up a data adapter, callbacks and a new step function for every call which costs more than the
+# model itself for the few rows the router asks for, a traced function is one graph call
+# one function is traced for each batch bucket the first time it is needed so the shapes never cause a retrace,
+# inputs are zero padded up to their bucket and bigger inputs are run in chunks of the largest bucket
+class CompiledModel():
+    def __init__(self, model, batch_buckets: tuple = BATCH_BUCKETS, name: string = None):
+        self.model = model
+        self.input_shape = tuple(model.input_shape)
+        self.batch_buckets = tuple(sorted(batch_buckets))
+        self.name = name or model.name
+
+        self._functions = {}
+        self._functions_lock = threading.Lock()
+
+    def get_function(self, batch_size: int):
+        function = self._functions.get(batch_size)
+        if function is None:
+            with self._functions_lock:
+                function = self._functions.get(batch_size)
+                if function is None:
+                    signature = [tf.TensorSpec((batch_size,) + self.input_shape[1:], tf.float32)]
+                    function = tf.function(lambda X: self.model(X, training=False), input_signature=signature)
+                    self._functions[batch_size] = function
+        return function
+
+    def get_bucket(self, batch_size: int) -> int:
+        for bucket in self.batch_buckets:
+            if batch_size <= bucket:
+                return bucket
+        return self.batch_buckets[-1]
+
+    def predict(self, X: np.ndarray, batch_size: int = None, verbose=0) -> np.ndarray:
+        # batch_size and verbose are taken for the same call as keras, the buckets decide the batches
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == len(self.input_shape) + 1 and X.shape[-1] == 1:
+            # keras drops a trailing axis of size 1 the model doesn't expect, the saes models are given (batch, lags, 1)
+            X = X[..., 0]
+
+        outputs = []
+        largest = self.batch_buckets[-1]
+        for start in range(0, len(X), largest):
+            chunk = X[start:start + largest]
+            bucket = self.get_bucket(len(chunk))
+            if len(chunk) < bucket:
+                chunk = np.concatenate([chunk, np.zeros((bucket - len(chunk),) + chunk.shape[1:], dtype=np.float32)])
+            y = self.get_function(bucket)(chunk).numpy()
+            outputs.append(y[:min(largest, len(X) - start)])
+        if len(outputs) == 0:
+            return np.zeros((0,) + tuple(self.model.output_shape[1:]), dtype=np.float32)
+        return np.concatenate(outputs)
+
+    def warm_up(self) -> None:
+        # trace every bucket now rather than on the first requests of each size
+        for bucket in self.batch_buckets:
+            self.get_function(bucket)(np.zeros((bucket,) + self.input_shape[1:], dtype=np.float32))
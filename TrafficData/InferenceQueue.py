@@ -0,0 +1,84 @@
+import queue
+import string
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from metrics import INFERENCE_BATCH_SIZE, INFERENCE_BATCH_REQUESTS
+
+# micro-batching queue in front of a model
+# callers submit their inputs and wait on a future, one worker thread collects the inputs waiting in the
+# queue for up to max_wait seconds or until max_batch_size samples are collected, runs a single predict
+# over all of them and hands each caller back the rows of the output belonging to its inputs
+class InferenceQueue():
+    def __init__(self, model, model_name: string, max_batch_size: int = 256, max_wait: float = 0.002):
+        self.model = model
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._requests = queue.Queue()
+        self._pending = None
+        self._worker = threading.Thread(target=self._run, name=f'inference-{model_name}', daemon=True)
+        self._worker.start()
+
+    def submit(self, X: np.ndarray) -> Future:
+        future = Future()
+        self._requests.put((X, future))
+        return future
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        # same call as the model so the queue can be used in its place
+        return self.submit(X).result()
+
+    def close(self) -> None:
+        self._requests.put(None)
+        self._worker.join()
+
+    def _collect(self) -> list:
+        # wait for the first request then gather more until the window closes or the batch is full
+        first = self._pending if self._pending is not None else self._requests.get()
+        self._pending = None
+        if first is None:
+            return None
+
+        batch = [first]
+        samples = len(first[0])
+        deadline = time.perf_counter() + self.max_wait
+        while samples < self.max_batch_size:
+            try:
+                request = self._requests.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            if request is None or samples + len(request[0]) > self.max_batch_size:
+                # keep the request for the next batch, a close is seen once this batch is done
+                self._pending = request
+                break
+            batch.append(request)
+            samples += len(request[0])
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            # callers that gave up waiting don't need their inputs predicted
+            batch = [(X, future) for X, future in batch if future.set_running_or_notify_cancel()]
+            if len(batch) == 0:
+                continue
+
+            lengths = [len(X) for X, _ in batch]
+            INFERENCE_BATCH_SIZE.observe(sum(lengths), model=self.model_name)
+            INFERENCE_BATCH_REQUESTS.observe(len(batch), model=self.model_name)
+            try:
+                y_pred = self.model.predict(np.concatenate([X for X, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            offsets = np.cumsum([0] + lengths)
+            for i, (_, future) in enumerate(batch):
+                future.set_result(y_pred[offsets[i]:offsets[i + 1]])
@@ -7,7 +7,7 @@ import argparse
 import numpy as np
 import pandas as pd
 import os
-from data.data import process_data_series,process_data_datetime
+from data.data import process_data_series,process_data_datetime,create_manifest,save_manifest
 from model import model
 from keras.models import Model
 from keras.callbacks import EarlyStopping
@@ -15,7 +15,7 @@ warnings.filterwarnings("ignore")
 
 
 
-def train_model(model, X_train, y_train, name, config):
+def train_model(model, X_train, y_train, name, config, manifest=None):
     """train
     train a single model.
 
@@ -25,6 +25,7 @@ def train_model(model, X_train, y_train, name, config):
         y_train: ndarray(number, ), result data for train.
         name: String, name of model.
         config: Dict, parameter for train.
+        manifest: Dict, saved next to the model so it can be loaded with matching inputs.
     """
     model.compile(loss="mse", optimizer="rmsprop", metrics=['mape'])
     # early = EarlyStopping(monitor='val_loss', patience=30, verbose=0, mode='auto')
@@ -34,12 +35,15 @@ def train_model(model, X_train, y_train, name, config):
         epochs=config["epochs"],
         validation_split=0.05)
 
-    model.save(os.path.join(os.path.dirname(__file__),'model','location_models',f'{name}.h5'))
+    model_path = os.path.join(os.path.dirname(__file__),'model','location_models',f'{name}.h5')
+    model.save(model_path)
+    if manifest is not None:
+        save_manifest(model_path, manifest)
     df = pd.DataFrame.from_dict(hist.history)
     df.to_csv(os.path.join(os.path.dirname(__file__),'model','location_models',f'{name} loss.csv'), encoding='utf-8', index=False)
 
 
-def train_seas(models, X_train, y_train, name, config):
+def train_seas(models, X_train, y_train, name, config, manifest=None):
     """train
     train the SAEs model.
 
@@ -49,6 +53,7 @@ def train_seas(models, X_train, y_train, name, config):
         y_train: ndarray(number, ), result data for train.
         name: String, name of model.
         config: Dict, parameter for train.
+        manifest: Dict, saved next to the model so it can be loaded with matching inputs.
     """
 
     temp = X_train
@@ -75,7 +80,7 @@ def train_seas(models, X_train, y_train, name, config):
         weights = models[i].get_layer('hidden').get_weights()
         saes.get_layer('hidden%d' % (i + 1)).set_weights(weights)
 
-    train_model(saes, X_train, y_train, name, config)
+    train_model(saes, X_train, y_train, name, config, manifest)
 
 def get_locations():
     with open(os.path.join(os.path.dirname(__file__),'data','locations','locations.txt')) as locations_file:
@@ -93,8 +98,13 @@ def main(argv):
     for location in locations:
         file1 = os.path.join(os.path.dirname(__file__),'data','locations',f'{location}-train.csv')
         file2 = os.path.join(os.path.dirname(__file__),'data','locations',f'{location}-test.csv')
-        X_train_series, y_train_series, _, _, _,_,_ = process_data_series(file1, file2, lag)
-        X_train_datetime, y_train_datetime, _, _, _,_,_,_,_,_,_ = process_data_datetime(file1, file2)
+        X_train_series, y_train_series, _, _, _,_,flow_scaler = process_data_series(file1, file2, lag)
+        X_train_datetime, y_train_datetime, _, _, _,_,_,_,_,days_scaler,times_scaler = process_data_datetime(file1, file2)
+
+        # the scalers and input layout are saved with each model so it can be used without the training data
+        scalers = {'flow': flow_scaler, 'days': days_scaler, 'times': times_scaler}
+        series_features = [f'flow t-{lag - i}' for i in range(lag)]
+        datetime_features = ['day', 'time']
 
         # train each type of model
         models_types = ['rnn']
@@ -104,27 +114,33 @@ def main(argv):
             if model_type == 'lstm':
                 X_train2 = np.reshape(X_train_series, (X_train_series.shape[0], X_train_series.shape[1], 1))
                 m = model.get_lstm([lag, 64, 64, 1])
-                train_model(m, X_train2, y_train_series, model_name, config)
+                manifest = create_manifest(model_type, lag, 'series', series_features, X_train2.shape[1:], scalers, [file1, file2])
+                train_model(m, X_train2, y_train_series, model_name, config, manifest)
             if model_type == 'rnn':
                 X_train2 = np.reshape(X_train_series, (X_train_series.shape[0], X_train_series.shape[1], 1))
                 m = model.get_rnn([lag, 64, 64, 1])
-                train_model(m, X_train2, y_train_series, model_name, config)
+                manifest = create_manifest(model_type, lag, 'series', series_features, X_train2.shape[1:], scalers, [file1, file2])
+                train_model(m, X_train2, y_train_series, model_name, config, manifest)
             if model_type == 'gru':
                 X_train2 = np.reshape(X_train_series, (X_train_series.shape[0], X_train_series.shape[1], 1))
                 m = model.get_gru([lag, 64, 64, 1])
-                train_model(m, X_train2, y_train_series, model_name, config)
+                manifest = create_manifest(model_type, lag, 'series', series_features, X_train2.shape[1:], scalers, [file1, file2])
+                train_model(m, X_train2, y_train_series, model_name, config, manifest)
             if model_type == 'saes':
                 X_train2 = np.reshape(X_train_series, (X_train_series.shape[0], X_train_series.shape[1]))
                 m = model.get_saes([lag, 400, 400, 400, 1])
-                train_seas(m, X_train2, y_train_series, model_name, config)
+                manifest = create_manifest(model_type, lag, 'series', series_features, X_train2.shape[1:], scalers, [file1, file2])
+                train_seas(m, X_train2, y_train_series, model_name, config, manifest)
             if model_type == 'new_saes':
                 X_train2 = np.reshape(X_train_series, (X_train_series.shape[0], X_train_series.shape[1], 1))
                 m = model.get_new_saes(lag,1,encoder_size=10,auto_encoder_count=3, fine_tuning_layers=[10])
-                train_model(m, X_train2, y_train_series, model_name, config)
+                manifest = create_manifest(model_type, lag, 'series', series_features, X_train2.shape[1:], scalers, [file1, file2])
+                train_model(m, X_train2, y_train_series, model_name, config, manifest)
             if model_type == 'average':
                 X_train2 = np.reshape(X_train_datetime, (X_train_datetime.shape[0], X_train_datetime.shape[1]))
                 m = model.get_average([2, 400, 400, 400, 1])
-                train_model(m, X_train2, y_train_datetime, model_name, config)
+                manifest = create_manifest(model_type, lag, 'datetime', datetime_features, X_train2.shape[1:], scalers, [file1, file2])
+                train_model(m, X_train2, y_train_datetime, model_name, config, manifest)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,249 @@
+import string
+import numpy as np
+
+# forward passes of the trained keras models in plain numpy
+# the weights are copied out of a loaded keras model once, predict then runs the whole batch through each layer
+# with a few matrix multiplies, without the per call overhead of keras predict on the small batches the router makes
+# the recurrent layers project the inputs of every time step in one multiply so only the recurrent state is looped over
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    # written with tanh so large negative inputs don't overflow exp
+    return 0.5 * (np.tanh(0.5 * x) + 1)
+
+def hard_sigmoid(x: np.ndarray) -> np.ndarray:
+    return np.clip(0.2 * x + 0.5, 0, 1)
+
+def linear(x: np.ndarray) -> np.ndarray:
+    return x
+
+def relu(x: np.ndarray, negative_slope: float = 0.0, max_value: float = None, threshold: float = 0.0) -> np.ndarray:
+    # same arguments as keras' relu
+    y = np.where(x >= threshold, x, negative_slope * (x - threshold)).astype(x.dtype)
+    if max_value is not None:
+        y = np.minimum(y, max_value)
+    return y
+
+ACTIVATIONS = {
+    'linear': linear,
+    'relu': relu,
+    'sigmoid': sigmoid,
+    'hard_sigmoid': hard_sigmoid,
+    'tanh': np.tanh,
+}
+
+def get_activation(config):
+    # activations are saved as a name, or as a config when a ReLU layer was passed to Activation
+    if isinstance(config, str):
+        if config not in ACTIVATIONS:
+            raise ValueError(f"Unsupported activation: {config}")
+        return ACTIVATIONS[config]
+    if isinstance(config, dict) and config.get('class_name') == 'ReLU':
+        parameters = config['config']
+        max_value = parameters.get('max_value')
+        negative_slope = float(parameters.get('negative_slope') or 0.0)
+        threshold = float(parameters.get('threshold') or 0.0)
+        return lambda x: relu(x, negative_slope, None if max_value is None else float(max_value), threshold)
+    raise ValueError(f"Unsupported activation: {config}")
+
+class Dense():
+    def __init__(self, kernel: np.ndarray, bias: np.ndarray, activation):
+        self.kernel = kernel
+        self.bias = bias
+        self.activation = activation
+
+    def __call__(self, X: np.ndarray) -> np.ndarray:
+        y = X @ self.kernel
+        if self.bias is not None:
+            y += self.bias
+        return self.activation(y)
+
+class Activation():
+    def __init__(self, activation):
+        self.activation = activation
+
+    def __call__(self, X: np.ndarray) -> np.ndarray:
+        return self.activation(X)
+
+# the base of the recurrent layers, X is (batch, steps, features)
+class Recurrent():
+    def __init__(self, kernel: np.ndarray, recurrent_kernel: np.ndarray, bias: np.ndarray, units: int, return_sequences: bool):
+        self.kernel = kernel
+        self.recurrent_kernel = recurrent_kernel
+        self.bias = bias
+        self.units = units
+        self.return_sequences = return_sequences
+
+    def project(self, X: np.ndarray, bias: np.ndarray) -> np.ndarray:
+        # the kernel applied to every time step at once, (steps, batch, gates * units) so each step is contiguous
+        projected = np.transpose(X, (1, 0, 2)) @ self.kernel
+        if bias is not None:
+            projected += bias
+        return projected
+
+    def step(self, x: np.ndarray, state: tuple) -> tuple:
+        raise NotImplementedError
+
+    def __call__(self, X: np.ndarray) -> np.ndarray:
+        projected = self.project(X, self.bias if self.bias is None or self.bias.ndim == 1 else self.bias[0])
+        state = self.initial_state(X.shape[0], X.dtype)
+        outputs = []
+        for x in projected:
+            h, state = self.step(x, state)
+            if self.return_sequences:
+                outputs.append(h)
+        if self.return_sequences:
+            return np.stack(outputs, axis=1)
+        return h
+
+    def initial_state(self, batch_size: int, dtype) -> tuple:
+        return (np.zeros((batch_size, self.units), dtype=dtype),)
+
+class SimpleRNN(Recurrent):
+    def __init__(self, kernel, recurrent_kernel, bias, units, return_sequences, activation):
+        super().__init__(kernel, recurrent_kernel, bias, units, return_sequences)
+        self.activation = activation
+
+    def step(self, x: np.ndarray, state: tuple) -> tuple:
+        h = self.activation(x + state[0] @ self.recurrent_kernel)
+        return h, (h,)
+
+# keras orders the lstm gates input, forget, cell, output
+class LSTM(Recurrent):
+    def __init__(self, kernel, recurrent_kernel, bias, units, return_sequences, activation, recurrent_activation):
+        super().__init__(kernel, recurrent_kernel, bias, units, return_sequences)
+        self.activation = activation
+        self.recurrent_activation = recurrent_activation
+
+    def initial_state(self, batch_size: int, dtype) -> tuple:
+        return (np.zeros((batch_size, self.units), dtype=dtype), np.zeros((batch_size, self.units), dtype=dtype))
+
+    def step(self, x: np.ndarray, state: tuple) -> tuple:
+        h, c = state
+        z = x + h @ self.recurrent_kernel
+        u = self.units
+        i = self.recurrent_activation(z[:, :u])
+        f = self.recurrent_activation(z[:, u:2 * u])
+        c = f * c + i * self.activation(z[:, 2 * u:3 * u])
+        o = self.recurrent_activation(z[:, 3 * u:])
+        h = o * self.activation(c)
+        return h, (h, c)
+
+# keras orders the gru gates update, reset, candidate
+# with reset_after the reset gate is applied after the recurrent multiply and the recurrent kernel has its own bias
+class GRU(Recurrent):
+    def __init__(self, kernel, recurrent_kernel, bias, units, return_sequences, activation, recurrent_activation, reset_after):
+        super().__init__(kernel, recurrent_kernel, bias, units, return_sequences)
+        self.activation = activation
+        self.recurrent_activation = recurrent_activation
+        self.reset_after = reset_after
+        self.recurrent_bias = bias[1] if bias is not None and bias.ndim == 2 else None
+
+    def step(self, x: np.ndarray, state: tuple) -> tuple:
+        h = state[0]
+        u = self.units
+        if self.reset_after:
+            recurrent = h @ self.recurrent_kernel
+            if self.recurrent_bias is not None:
+                recurrent += self.recurrent_bias
+            z = self.recurrent_activation(x[:, :u] + recurrent[:, :u])
+            r = self.recurrent_activation(x[:, u:2 * u] + recurrent[:, u:2 * u])
+            candidate = self.activation(x[:, 2 * u:] + r * recurrent[:, 2 * u:])
+        else:
+            recurrent = h @ self.recurrent_kernel[:, :2 * u]
+            z = self.recurrent_activation(x[:, :u] + recurrent[:, :u])
+            r = self.recurrent_activation(x[:, u:2 * u] + recurrent[:, u:])
+            candidate = self.activation(x[:, 2 * u:] + (r * h) @ self.recurrent_kernel[:, 2 * u:])
+        h = z * h + (1 - z) * candidate
+        return h, (h,)
+
+def convert_layer(layer):
+    # numpy layer doing the same as the keras layer, None for layers that do nothing at inference
+    # the custom layers of fix_model are matched through the keras classes they extend
+    names = [cls.__name__ for cls in type(layer).__mro__]
+    config = layer.get_config()
+    weights = [np.asarray(w, dtype=np.float32) for w in layer.get_weights()]
+
+    if 'InputLayer' in names or 'Dropout' in names:
+        return None
+    if 'Activation' in names:
+        return Activation(get_activation(config['activation']))
+    if 'Dense' in names:
+        return Dense(weights[0], weights[1] if config['use_bias'] else None, get_activation(config['activation']))
+
+    if 'LSTM' in names or 'GRU' in names or 'SimpleRNN' in names:
+        if config.get('go_backwards') or config.get('stateful') or config.get('return_state'):
+            raise ValueError(f"Unsupported recurrent layer options in {layer.name}")
+        kernel, recurrent_kernel = weights[0], weights[1]
+        bias = weights[2] if config['use_bias'] else None
+        arguments = (kernel, recurrent_kernel, bias, config['units'], config['return_sequences'], get_activation(config['activation']))
+        if 'LSTM' in names:
+            return LSTM(*arguments, get_activation(config['recurrent_activation']))
+        if 'GRU' in names:
+            return GRU(*arguments, get_activation(config['recurrent_activation']), config['reset_after'])
+        return SimpleRNN(*arguments)
+
+    raise ValueError(f"Unsupported layer {layer.name} ({type(layer).__name__})")
+
+# a sequential keras model converted layer by layer, used in place of the keras model by the predictor
+class NumpyModel():
+    def __init__(self, layers: list, input_shape: tuple, name: string = None):
+        self.layers = layers
+        self.input_shape = input_shape
+        self.name = name
+
+    @classmethod
+    def from_keras(cls, model):
+        layers = [convert_layer(layer) for layer in model.layers]
+        return cls([layer for layer in layers if layer is not None], tuple(model.input_shape), model.name)
+
+    def predict(self, X: np.ndarray, batch_size: int = None, verbose=0) -> np.ndarray:
+        # batch_size and verbose are taken for the same call as keras, the whole input is always one batch
+        y = np.asarray(X, dtype=np.float32)
+        if y.ndim == len(self.input_shape) + 1 and y.shape[-1] == 1:
+            # keras drops a trailing axis of size 1 the model doesn't expect, the saes models are given (batch, lags, 1)
+            y = y[..., 0]
+        for layer in self.layers:
+            y = layer(y)
+        return y
+
+    def __call__(self, X: np.ndarray) -> np.ndarray:
+        return self.predict(X)
+
+def load_numpy_model(path: string) -> NumpyModel:
+    from fix_model import load_model_without_time_major
+    return NumpyModel.from_keras(load_model_without_time_major(path))
+
+# check the numpy models give the same outputs as keras for every trained model
+# python -m TrafficData.NumpyInference [model names]
+if __name__ == '__main__':
+    import os
+    import sys
+    import time
+    from fix_model import load_model_without_time_major
+
+    model_names = sys.argv[1:] or ['lstm', 'gru', 'rnn', 'saes', 'new_saes', 'average']
+    rng = np.random.default_rng(0)
+    failed = False
+    for model_name in model_names:
+        path = os.path.join(os.path.dirname(__file__), 'SingleModelScats', 'model', f'{model_name}.h5')
+        if not os.path.exists(path):
+            print(f"{model_name}: no model file")
+            continue
+
+        keras_model = load_model_without_time_major(path)
+        numpy_model = NumpyModel.from_keras(keras_model)
+        for batch_size in (1, 32, 256):
+            X = rng.random((batch_size,) + tuple(keras_model.input_shape[1:]), dtype=np.float32)
+            start = time.perf_counter()
+            expected = keras_model.predict(X, verbose=0)
+            keras_time = time.perf_counter() - start
+            start = time.perf_counter()
+            actual = numpy_model.predict(X)
+            numpy_time = time.perf_counter() - start
+
+            error = float(np.max(np.abs(expected - actual)))
+            passed = actual.shape == expected.shape and error < 1e-5
+            failed = failed or not passed
+            print(f"{model_name} batch {batch_size}: max error {error:.2e} keras {keras_time * 1000:.2f}ms numpy {numpy_time * 1000:.2f}ms {'ok' if passed else 'MISMATCH'}")
+
+    sys.exit(1 if failed else 0)
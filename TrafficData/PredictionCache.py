@@ -0,0 +1,85 @@
+import datetime
+import math
+import string
+import threading
+from collections import OrderedDict
+from metrics import PREDICTION_CACHE_HITS, PREDICTION_CACHE_MISSES
+
+BUCKET_MINUTES = 15 # the models predict in 15 minute intervals
+
+# bounded LRU cache of traffic flow predictions
+# predictions are keyed by scats site, 15 minute interval, model name and steps so a search only runs
+# one inference for each site and interval, the cache is thread safe and can be shared across searches
+class PredictionCache():
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._predictions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_bucket(date: datetime.datetime) -> datetime.datetime:
+        # the start of the 15 minute interval the date falls in
+        return date.replace(minute=date.minute - date.minute % BUCKET_MINUTES, second=0, microsecond=0)
+
+    def get_key(self, location: int, date: datetime.datetime, steps: int, model_name: string) -> tuple:
+        return (int(location), self.get_bucket(date), model_name, steps)
+
+    def get(self, key: tuple):
+        with self._lock:
+            flow = self._predictions.get(key)
+            if flow is None:
+                self.misses += 1
+                PREDICTION_CACHE_MISSES.inc()
+                return None
+
+            self.hits += 1
+            PREDICTION_CACHE_HITS.inc()
+            self._predictions.move_to_end(key)
+            return flow
+
+    def put(self, key: tuple, flow: float) -> None:
+        with self._lock:
+            self._predictions[key] = flow
+            self._predictions.move_to_end(key)
+            while len(self._predictions) > self.max_size:
+                self._predictions.popitem(last=False)
+
+    def predict_traffic_flow(self, predictor, location: int, date: datetime.datetime, steps: int, model_name: string) -> float:
+        key = self.get_key(location, date, steps, model_name)
+        flow = self.get(key)
+        if flow is None:
+            # predict from the start of the interval so the cached value doesn't depend on which search asked first
+            flow = predictor.predict_traffic_flow(key[0], key[1], steps, model_name)
+            self.put(key, flow)
+        return flow
+
+    def predict_traffic_flows(self, predictor, requests: list, steps: int, model_name: string) -> list:
+        # predict the flow for many (location, date) pairs, the misses are predicted in one batched call
+        # locations the predictor has no data for come back as nan and aren't cached
+        keys = [self.get_key(location, date, steps, model_name) for location, date in requests]
+        flows = [self.get(key) for key in keys]
+
+        missing = list(dict.fromkeys(key for key, flow in zip(keys, flows) if flow is None))
+        if len(missing) > 0:
+            predicted = predictor.predict_traffic_flows([(key[0], key[1]) for key in missing], steps, model_name)
+            for key, flow in zip(missing, predicted):
+                if not math.isnan(flow):
+                    self.put(key, float(flow))
+            predicted = dict(zip(missing, predicted))
+            flows = [float(predicted[key]) if flow is None else flow for key, flow in zip(keys, flows)]
+
+        return flows
+
+    def clear(self) -> None:
+        with self._lock:
+            self._predictions.clear()
+
+    def __contains__(self, key: tuple) -> bool:
+        with self._lock:
+            return key in self._predictions
+
+    def __len__(self) -> int:
+        return len(self._predictions)
@@ -2,13 +2,196 @@
 Processing the data
 """
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import pandas as pd
 import datetime
+import hashlib
+import json
+import os
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
 
+MANIFEST_VERSION = 1 # bump when the layout of the model manifests changes
+
+DATASET_VERSION = 2 # bump when the columnar datasets or the processed outputs change layout
+
+LANE_FLOW_ATTR = 'Lane 1 Flow (Veh/5 Minutes)'
+SCATS_NUMBER_ATTR = 'SCATS'
+DATE_TIME_ATTR = '5 Minutes'
+DATE_FORMAT = '%d/%m/%Y %H:%M' # Date Format: 3/10/2006 2:45
+
+def parse_dates(date_strings):
+    """Parse dates
+    Parse many dates in the dataset format in one pass. Every site shares the
+    same dates so each distinct date is only parsed once.
+
+    # Arguments
+        date_strings: List/ndarray, dates like 3/10/2006 2:45.
+    # Returns
+        timestamps: ndarray(int64), minutes since the epoch.
+    """
+    codes, distinct = pd.factorize(np.asarray(date_strings))
+    timestamps = pd.to_datetime(distinct, format=DATE_FORMAT).values.astype('datetime64[m]').astype(np.int64)
+    return timestamps[codes]
+
+def get_datetime_features(timestamps):
+    """Extract datetime features
+    Weekday and minute of the day of many timestamps in one pass.
+
+    # Arguments
+        timestamps: ndarray, datetime64 values or int64 minutes since the epoch.
+    # Returns
+        days: ndarray(int64), day of the week with monday as 0.
+        times: ndarray(int64), minutes since midnight.
+    """
+    timestamps = np.asarray(timestamps)
+    if np.issubdtype(timestamps.dtype, np.datetime64):
+        timestamps = timestamps.astype('datetime64[m]').astype(np.int64)
+    days, times = np.divmod(timestamps, 1440)
+    # 1970-01-01 was a thursday
+    return (days + 3) % 7, times
+
+def convert_dataset(file, digest=None):
+    """Convert a dataset
+    Save the columns of a .csv as a columnar .npz next to it, partitioned by site.
+    Rows are stored grouped by site with the offset of each site's partition and
+    the position of each row in the .csv so the original order can be restored.
+
+    # Arguments
+        file: String, name of .csv file.
+        digest: String, hash of the .csv, worked out when not given.
+    # Returns
+        columns: Dict, int64 timestamps (minutes since the epoch), int64 site ids
+            and float32 flows in the order of the .csv.
+    """
+    df = pd.read_csv(file, encoding='utf-8').fillna(0)
+    columns = {
+        'timestamp': parse_dates(df[DATE_TIME_ATTR]),
+        'scats': df[SCATS_NUMBER_ATTR].values.astype(np.int64),
+        'flow': df[LANE_FLOW_ATTR].values.astype(np.float32)
+    }
+
+    rows = np.argsort(columns['scats'], kind='stable')
+    sites, counts = np.unique(columns['scats'][rows], return_counts=True)
+    np.savez(os.path.splitext(file)[0] + '.npz',
+             version=DATASET_VERSION,
+             source_sha256=digest or hash_dataset(file),
+             sites=sites,
+             offsets=np.concatenate([[0], np.cumsum(counts)]),
+             rows=rows,
+             **{name: column[rows] for name, column in columns.items()})
+    return columns
+
+def read_dataset(file):
+    """Read a dataset
+    Load the columns from the .npz store, converting the .csv first if the store
+    is missing or was made from a different version of it.
+
+    # Arguments
+        file: String, name of .csv file.
+    # Returns
+        columns: Dict, timestamp, scats and flow columns in the order of the .csv.
+    """
+    digest = hash_dataset(file)
+    store = os.path.splitext(file)[0] + '.npz'
+    if os.path.exists(store):
+        with np.load(store) as data:
+            if int(data['version']) == DATASET_VERSION and str(data['source_sha256']) == digest:
+                rows = data['rows']
+                columns = {}
+                for name in ('timestamp', 'scats', 'flow'):
+                    columns[name] = np.empty_like(data[name])
+                    columns[name][rows] = data[name]
+                return columns
+    return convert_dataset(file, digest)
+
+def get_processed_path(kind, files, *args):
+    """Name the processed outputs
+    The outputs are kept in a processed folder beside the data, keyed by the hash
+    of the data files and the arguments they were processed with.
+
+    # Arguments
+        kind: String, which loader the outputs are from.
+        files: List, names of the .csv files.
+        args: arguments the outputs depend on.
+    # Returns
+        path: String, name of the .npz file.
+    """
+    key = hashlib.sha256(json.dumps([DATASET_VERSION, kind, hash_dataset(*files), list(args)]).encode()).hexdigest()
+    return os.path.join(os.path.dirname(os.path.abspath(files[0])), 'processed', f'{kind}-{key[:32]}.npz')
+
+def load_processed(path):
+    """Load processed outputs
+
+    # Arguments
+        path: String, name from get_processed_path.
+    # Returns
+        arrays: Dict, or None if they haven't been saved.
+        scalers: Dict, MinMaxScalers by name.
+    """
+    if not os.path.exists(path):
+        return None, None
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files if name != 'scalers'}
+        scalers = {name: scaler_from_dict(parameters) for name, parameters in json.loads(str(data['scalers'])).items()}
+    return arrays, scalers
+
+def save_processed(path, arrays, scalers):
+    """Save processed outputs
+
+    # Arguments
+        path: String, name from get_processed_path.
+        arrays: Dict, ndarrays by name.
+        scalers: Dict, MinMaxScalers by name.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary file first so a reader never sees a partly written file
+    temporary = path + f'.{os.getpid()}.tmp.npz'
+    np.savez(temporary, scalers=json.dumps({name: scaler_to_dict(scaler) for name, scaler in scalers.items()}), **arrays)
+    os.replace(temporary, path)
+
+def shuffle_rows(X, y):
+    """Shuffle the rows of the inputs and results together by gathering them in a random order."""
+    order = np.random.permutation(len(X))
+    return np.take(X, order, axis=0), np.take(y, order)
+
+def get_windows(values, lags):
+    """View of the time lag windows over the values, one row of the lags and the value for each value after the first lags."""
+    if len(values) <= lags:
+        return np.empty((0, lags + 1), dtype=values.dtype)
+    return sliding_window_view(values, lags + 1)
+
+def build_data_series(train, test, lags):
+    """Scale the flows and sites and split them into time lag windows, unshuffled.
+    The rows of both files are returned as one float32 array with the number of train rows."""
+    df1 = read_dataset(train)
+    df2 = read_dataset(test)
+
+    # scaler = StandardScaler().fit(df1[attr].values)
+    flow_scaler = MinMaxScaler(feature_range=(0, 1)).fit(df1['flow'].astype(np.float64).reshape(-1, 1))
+    flow1 = flow_scaler.transform(df1['flow'].astype(np.float64).reshape(-1, 1)).reshape(1, -1)[0].astype(np.float32)
+    flow2 = flow_scaler.transform(df2['flow'].astype(np.float64).reshape(-1, 1)).reshape(1, -1)[0].astype(np.float32)
+
+    scats_scalar = MinMaxScaler(feature_range=(0, 1)).fit(df1['scats'].reshape(-1, 1))
+    scats1 = scats_scalar.transform(df1['scats'].reshape(-1, 1)).reshape(1, -1)[0].astype(np.float32)
+    scats2 = scats_scalar.transform(df2['scats'].reshape(-1, 1)).reshape(1, -1)[0].astype(np.float32)
+
+    # each row is the previous lags flows and the site, the result is the flow at the end of the window
+    windows1 = get_windows(flow1, lags)
+    windows2 = get_windows(flow2, lags)
+    train_size = len(windows1)
+    X = np.empty((train_size + len(windows2), lags + 1), dtype=np.float32)
+    X[:train_size, :lags] = windows1[:, :-1]
+    X[:train_size, lags] = scats1[lags:]
+    X[train_size:, :lags] = windows2[:, :-1]
+    X[train_size:, lags] = scats2[lags:]
+    y = np.concatenate([windows1[:, -1], windows2[:, -1]])
+
+    return {'X': X, 'y': y, 'train_size': train_size}, {'flow': flow_scaler, 'scats': scats_scalar}
+
 def process_data_series(train, test, lags,scats_id = 970):
     """Process data
     Reshape and split train\test data.
+    The processed data is saved the first time and loaded again while the files don't change.
 
     # Arguments
         train: String, name of .csv train file.
@@ -21,56 +204,58 @@ def process_data_series(train, test, lags,scats_id = 970):
         y_test: ndarray.
         scaler: StandardScaler.
     """
-    lane_flow_attr = 'Lane 1 Flow (Veh/5 Minutes)'
-    scats_number_attr = 'SCATS'
-
-    df1 = pd.read_csv(train, encoding='utf-8').fillna(0)
-    df2 = pd.read_csv(test, encoding='utf-8').fillna(0)
+    path = get_processed_path('series', [train, test], lags)
+    arrays, scalers = load_processed(path)
+    if arrays is None:
+        arrays, scalers = build_data_series(train, test, lags)
+        save_processed(path, arrays, scalers)
+    flow_scaler, scats_scalar = scalers['flow'], scalers['scats']
 
-    # scaler = StandardScaler().fit(df1[attr].values)
-    flow_scaler = MinMaxScaler(feature_range=(0, 1)).fit(df1[lane_flow_attr].values.reshape(-1, 1))
-    flow1 = flow_scaler.transform(df1[lane_flow_attr].values.reshape(-1, 1)).reshape(1, -1)[0]
-    flow2 = flow_scaler.transform(df2[lane_flow_attr].values.reshape(-1, 1)).reshape(1, -1)[0]
-
-    scats_scalar = MinMaxScaler(feature_range=(0, 1)).fit(df1[scats_number_attr].values.reshape(-1, 1))
-    scats1 = scats_scalar.transform(df1[scats_number_attr].values.reshape(-1, 1)).reshape(1, -1)[0]
-    scats2 = scats_scalar.transform(df2[scats_number_attr].values.reshape(-1, 1)).reshape(1, -1)[0]
-
-    train, test, data = [], [], []
-    for i in range(lags, len(flow1)):
-        row = [*flow1[i - lags: i],scats1[i],flow1[i]]
-        train.append(row)
-        data.append(row)
-
-    for i in range(lags, len(flow2)):
-        row = [*flow2[i - lags: i],scats2[i],flow2[i]]
-        test.append(row)
-        data.append(row)
-
-    data = np.array(data)
-    train = np.array(train)
-    test = np.array(test)
-    np.random.shuffle(train)
-
-    X = data[:, :-1]
-    y = data[:,-1]
-    
-    X_train = train[:, :-1]
-    y_train = train[:, -1]
-
-    X_test = test[:, :-1]
-    y_test = test[:, -1]
+    # the train and test rows are views of the rows of both files, only the shuffled train rows are copied
+    X, y, train_size = arrays['X'], arrays['y'], int(arrays['train_size'])
+    X_train, y_train = shuffle_rows(X[:train_size], y[:train_size])
+    X_test, y_test = X[train_size:], y[train_size:]
 
     scats_id = scats_scalar.transform(np.array([scats_id]).reshape(-1,1)).reshape(1,-1)[0][0]
-    location_indices = [i for i in range(len(X)) if X[i][lags] == scats_id]
+    location_indices = X[:, lags] == np.float32(scats_id)
     X_location = X[location_indices]
     y_location = y[location_indices]
 
     return X_train, y_train, X_test, y_test, X,y,X_location,y_location,flow_scaler,scats_scalar
 
+def build_data_datetime(train, test):
+    """Scale the day, time, site and flow of every row, unshuffled."""
+    df1 = read_dataset(train)
+    df2 = read_dataset(test)
+
+    flow_scaler = MinMaxScaler(feature_range=(0, 1)).fit(df1['flow'].astype(np.float64).reshape(-1, 1))
+    flow1 = flow_scaler.transform(df1['flow'].astype(np.float64).reshape(-1, 1)).reshape(1, -1)[0]
+    flow2 = flow_scaler.transform(df2['flow'].astype(np.float64).reshape(-1, 1)).reshape(1, -1)[0]
+
+    scats_scalar = MinMaxScaler(feature_range=(0, 1)).fit(df1['scats'].reshape(-1, 1))
+    scats1 = scats_scalar.transform(df1['scats'].reshape(-1, 1)).reshape(1, -1)[0]
+    scats2 = scats_scalar.transform(df2['scats'].reshape(-1, 1)).reshape(1, -1)[0]
+
+    days1, times1 = get_datetime_features(df1['timestamp'])
+    days2, times2 = get_datetime_features(df2['timestamp'])
+    day_scalar = MinMaxScaler(feature_range=(0, 1)).fit(days1.reshape(-1, 1))
+    days1 = day_scalar.transform(days1.reshape(-1, 1)).reshape(1, -1)[0]
+    days2 = day_scalar.transform(days2.reshape(-1, 1)).reshape(1, -1)[0]
+
+    time_scalar = MinMaxScaler(feature_range=(0, 1)).fit(times1.reshape(-1, 1))
+    times1 = time_scalar.transform(times1.reshape(-1, 1)).reshape(1, -1)[0]
+    times2 = time_scalar.transform(times2.reshape(-1, 1)).reshape(1, -1)[0]
+
+    train = np.column_stack([days1, times1, scats1, flow1])
+    test = np.column_stack([days2, times2, scats2, flow2])
+
+    arrays = {'X_train': train[:, :-1], 'y_train': train[:, -1], 'X_test': test[:, :-1], 'y_test': test[:, -1]}
+    return arrays, {'flow': flow_scaler, 'scats': scats_scalar, 'days': day_scalar, 'times': time_scalar}
+
 def process_data_datetime(train, test,scats_id = 970,day=0):
     """Process data
     Reshape and split train\test data.
+    The processed data is saved the first time and loaded again while the files don't change.
 
     # Arguments
         train: String, name of .csv train file.
@@ -83,69 +268,135 @@ def process_data_datetime(train, test,scats_id = 970,day=0):
         y_test: ndarray.
         scaler: StandardScaler.
     """
+    path = get_processed_path('datetime', [train, test])
+    arrays, scalers = load_processed(path)
+    if arrays is None:
+        arrays, scalers = build_data_datetime(train, test)
+        save_processed(path, arrays, scalers)
+    flow_scaler, scats_scalar, day_scalar, time_scalar = scalers['flow'], scalers['scats'], scalers['days'], scalers['times']
 
-    lane_flow_attr = 'Lane 1 Flow (Veh/5 Minutes)'
-    scats_number_attr = 'SCATS'
-    date_time_attr = '5 Minutes'
+    X = np.concatenate([arrays['X_train'], arrays['X_test']])
+    y = np.concatenate([arrays['y_train'], arrays['y_test']])
+    X_train, y_train = shuffle_rows(arrays['X_train'], arrays['y_train'])
+    X_test, y_test = arrays['X_test'], arrays['y_test']
 
-    df1 = pd.read_csv(train, encoding='utf-8').fillna(0)
-    df2 = pd.read_csv(test, encoding='utf-8').fillna(0)
+    day = day_scalar.transform(np.array([day]).reshape(-1,1)).reshape(1,-1)[0][0]
+    scats_id = scats_scalar.transform(np.array([scats_id]).reshape(-1,1)).reshape(1,-1)[0][0]
+    location_indices = (X[:, 2] == scats_id) & (X[:, 0] == day)
+    X_location = X[location_indices]
+    y_location = y[location_indices]
 
-    flow_scaler = MinMaxScaler(feature_range=(0, 1)).fit(df1[lane_flow_attr].values.reshape(-1, 1))
-    flow1 = flow_scaler.transform(df1[lane_flow_attr].values.reshape(-1, 1)).reshape(1, -1)[0]
-    flow2 = flow_scaler.transform(df2[lane_flow_attr].values.reshape(-1, 1)).reshape(1, -1)[0]
+    return X_train, y_train, X_test, y_test,X,y,X_location,y_location, flow_scaler, scats_scalar,day_scalar,time_scalar
 
-    scats_scalar = MinMaxScaler(feature_range=(0, 1)).fit(df1[scats_number_attr].values.reshape(-1, 1))
-    scats1 = scats_scalar.transform(df1[scats_number_attr].values.reshape(-1, 1)).reshape(1, -1)[0]
-    scats2 = scats_scalar.transform(df2[scats_number_attr].values.reshape(-1, 1)).reshape(1, -1)[0]
+def hash_dataset(*files):
+    """Hash the dataset
+    SHA-256 over the contents of the data files, in order.
 
-    dates1 = list(map(parse_date,df1[date_time_attr].values))
-    dates2 = list(map(parse_date,df2[date_time_attr].values))
+    # Arguments
+        files: String, names of the .csv files.
+    # Returns
+        digest: String, hex digest.
+    """
+    digest = hashlib.sha256()
+    for file in files:
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
 
-    days1 = np.array(list(map(lambda d: d.weekday(),dates1)))
-    days2 = np.array(list(map(lambda d: d.weekday(),dates2)))
-    day_scalar = MinMaxScaler(feature_range=(0, 1)).fit(days1.reshape(-1, 1))
-    days1 = day_scalar.transform(days1.reshape(-1, 1)).reshape(1, -1)[0]
-    days2 = day_scalar.transform(days2.reshape(-1, 1)).reshape(1, -1)[0]
+def scaler_to_dict(scaler):
+    """Serialise a scaler
+    Keep only the fitted parameters of a MinMaxScaler.
 
-    times1 = np.array(list(map(lambda d: d.hour * 60 + d.minute,dates1)))
-    times2 = np.array(list(map(lambda d: d.hour * 60 + d.minute,dates2)))
-    time_scalar = MinMaxScaler(feature_range=(0, 1)).fit(times1.reshape(-1, 1))
-    times1 = time_scalar.transform(times1.reshape(-1, 1)).reshape(1, -1)[0]
-    times2 = time_scalar.transform(times2.reshape(-1, 1)).reshape(1, -1)[0]
+    # Arguments
+        scaler: MinMaxScaler, fitted scaler.
+    # Returns
+        parameters: Dict, json serialisable parameters.
+    """
+    return {
+        'feature_range': list(scaler.feature_range),
+        'min': scaler.min_.tolist(),
+        'scale': scaler.scale_.tolist(),
+        'data_min': scaler.data_min_.tolist(),
+        'data_max': scaler.data_max_.tolist(),
+        'n_samples_seen': int(scaler.n_samples_seen_)
+    }
 
-    train, test,data = [], [],[]
-    for i in range(len(flow1)):
-        row = [days1[i],times1[i],scats1[i],flow1[i]]
-        train.append(row)
-        data.append(row)
+def scaler_from_dict(parameters):
+    """Restore a scaler
+    Rebuild a fitted MinMaxScaler without refitting it.
 
-    for i in range(len(flow2)):
-        row = [days2[i],times2[i],scats2[i],flow2[i]]
-        test.append(row)
-        data.append(row)
+    # Arguments
+        parameters: Dict, parameters from scaler_to_dict.
+    # Returns
+        scaler: MinMaxScaler.
+    """
+    scaler = MinMaxScaler(feature_range=tuple(parameters['feature_range']))
+    scaler.min_ = np.array(parameters['min'])
+    scaler.scale_ = np.array(parameters['scale'])
+    scaler.data_min_ = np.array(parameters['data_min'])
+    scaler.data_max_ = np.array(parameters['data_max'])
+    scaler.data_range_ = scaler.data_max_ - scaler.data_min_
+    scaler.n_features_in_ = len(scaler.min_)
+    scaler.n_samples_seen_ = parameters['n_samples_seen']
+    return scaler
 
-    data = np.array(data)
-    train = np.array(train)
-    test = np.array(test)
-    np.random.shuffle(train)
+def create_manifest(model_type, lags, inputs, features, input_shape, scalers, files):
+    """Create a model manifest
+    Everything needed to prepare inputs for a trained model and check it matches its data.
 
-    X = data[:, :-1]
-    y = data[:, -1]
+    # Arguments
+        model_type: String, type of model (lstm, gru, average...).
+        lags: integer, time lag.
+        inputs: String, input layout, 'series' or 'datetime'.
+        features: List, name of each input feature in order.
+        input_shape: Tuple, shape of one model input.
+        scalers: Dict, fitted MinMaxScalers by name.
+        files: List, names of the .csv files the model was trained on.
+    # Returns
+        manifest: Dict.
+    """
+    return {
+        'version': MANIFEST_VERSION,
+        'model_type': model_type,
+        'lags': lags,
+        'inputs': inputs,
+        'features': list(features),
+        'input_shape': [int(size) for size in input_shape],
+        'scalers': {name: scaler_to_dict(scaler) for name, scaler in scalers.items()},
+        'dataset': {
+            'files': [os.path.basename(file) for file in files],
+            'sha256': hash_dataset(*files)
+        }
+    }
 
-    day = day_scalar.transform(np.array([day]).reshape(-1,1)).reshape(1,-1)[0][0]
-    scats_id = scats_scalar.transform(np.array([scats_id]).reshape(-1,1)).reshape(1,-1)[0][0]
-    location_indices = [i for i in range(len(X)) if X[i][2] == scats_id and X[i][0] == day]
-    X_location = X[location_indices]
-    y_location = y[location_indices]
+def save_manifest(file, manifest):
+    """Save a model manifest
+    Written next to the model with the same name and a .json extension.
 
-    X_train = train[:, :-1]
-    y_train = train[:, -1]
+    # Arguments
+        file: String, name of the model .h5 file.
+        manifest: Dict, manifest from create_manifest.
+    """
+    with open(os.path.splitext(file)[0] + '.json', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
 
-    X_test = test[:, :-1]
-    y_test = test[:, -1]
+def load_manifest(file):
+    """Load a model manifest
 
-    return X_train, y_train, X_test, y_test,X,y,X_location,y_location, flow_scaler, scats_scalar,day_scalar,time_scalar
+    # Arguments
+        file: String, name of the model .h5 file.
+    # Returns
+        manifest: Dict, or None for models saved without one.
+    """
+    manifest_path = os.path.splitext(file)[0] + '.json'
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get('version', 0) > MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version {manifest.get('version')} in {manifest_path}")
+    return manifest
 
 # Date Format: 3/10/2006 2:45
 def parse_date(date_string):
@@ -0,0 +1,113 @@
+"""
+Streaming the training data
+"""
+import json
+import os
+import numpy as np
+from keras.utils import Sequence
+from sklearn.preprocessing import MinMaxScaler
+from data.data import read_dataset, get_processed_path, get_datetime_features, scaler_to_dict, scaler_from_dict
+
+def fit_scaler(values):
+    return MinMaxScaler(feature_range=(0, 1)).fit(values.reshape(-1, 1))
+
+def open_flow_stream(train):
+    """Open the flow stream
+    Scale the flows and sites of the train file once and save them as a memory
+    mapped [2, rows] float32 array, flows then sites, beside the processed data.
+    The scalers are fitted the same way as process_data_series and
+    process_data_datetime fit them.
+
+    # Arguments
+        train: String, name of .csv train file.
+    # Returns
+        stream: ndarray(2, rows), memory mapped scaled flows and sites.
+        scalers: Dict, flow, scats, days and times MinMaxScalers.
+    """
+    path = os.path.splitext(get_processed_path('stream', [train]))[0]
+    if not os.path.exists(path + '.npy'):
+        columns = read_dataset(train)
+        flows = columns['flow'].astype(np.float64)
+        days, times = get_datetime_features(columns['timestamp'])
+        scalers = {'flow': fit_scaler(flows), 'scats': fit_scaler(columns['scats']), 'days': fit_scaler(days), 'times': fit_scaler(times)}
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = path + f'.{os.getpid()}.tmp.npy'
+        stream = np.lib.format.open_memmap(temporary, mode='w+', dtype=np.float32, shape=(2, len(flows)))
+        stream[0] = scalers['flow'].transform(flows.reshape(-1, 1))[:, 0]
+        stream[1] = scalers['scats'].transform(columns['scats'].reshape(-1, 1))[:, 0]
+        stream.flush()
+        del stream
+        with open(path + '.json', 'w') as scalers_file:
+            json.dump({name: scaler_to_dict(scaler) for name, scaler in scalers.items()}, scalers_file)
+        os.replace(temporary, path + '.npy')
+
+    with open(path + '.json') as scalers_file:
+        scalers = {name: scaler_from_dict(parameters) for name, parameters in json.load(scalers_file).items()}
+    return np.load(path + '.npy', mmap_mode='r'), scalers
+
+class WindowSequence(Sequence):
+    """Batches of time lag windows
+    Each batch gathers its windows from the memory mapped stream when keras asks
+    for it, so only the batches waiting in the fit queue are ever in memory.
+    A window is the lags flows before a row and the row's site, the result is the
+    row's flow, the same rows process_data_series makes.
+
+    # Arguments
+        stream: ndarray(2, rows), scaled flows and sites from open_flow_stream.
+        rows: ndarray, rows to make windows for, each at least lags into the stream.
+        lags: integer, time lag.
+        batch_size: integer, windows in each batch.
+        shuffle: Boolean, shuffle the windows again at the end of every epoch.
+        flatten: Boolean, give the windows as (batch, lags + 1) instead of (batch, lags + 1, 1).
+    """
+    def __init__(self, stream, rows, lags, batch_size, shuffle=True, flatten=False):
+        super().__init__()
+        self.stream = stream
+        self.rows = np.array(rows, dtype=np.int64)
+        self.lags = lags
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.flatten = flatten
+        self.offsets = np.arange(-lags, 0)
+        if shuffle:
+            np.random.shuffle(self.rows)
+
+    def __len__(self):
+        return (len(self.rows) + self.batch_size - 1) // self.batch_size
+
+    def __getitem__(self, index):
+        # reading the rows of a batch in order keeps the reads from the memory map close together
+        rows = np.sort(self.rows[index * self.batch_size:(index + 1) * self.batch_size])
+        X = np.empty((len(rows), self.lags + 1), dtype=np.float32)
+        X[:, :self.lags] = self.stream[0][rows[:, np.newaxis] + self.offsets]
+        X[:, self.lags] = self.stream[1][rows]
+        y = np.asarray(self.stream[0][rows])
+        if not self.flatten:
+            X = np.reshape(X, (X.shape[0], X.shape[1], 1))
+        return X, y
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.rows)
+
+def get_window_sequences(stream, lags, batch_size, validation_split=0.05, flatten=False):
+    """Split the windows
+    Hold a random share of the windows out for validation, like fit's
+    validation_split does for the shuffled windows of process_data_series.
+
+    # Arguments
+        stream: ndarray(2, rows), scaled flows and sites from open_flow_stream.
+        lags: integer, time lag.
+        batch_size: integer, windows in each batch.
+        validation_split: float, share of the windows held out.
+        flatten: Boolean, give the windows without a feature axis.
+    # Returns
+        train: WindowSequence.
+        validation: WindowSequence.
+    """
+    rows = np.random.permutation(np.arange(lags, stream.shape[1]))
+    split = int(len(rows) * (1 - validation_split))
+    train = WindowSequence(stream, rows[:split], lags, batch_size, flatten=flatten)
+    validation = WindowSequence(stream, rows[split:], lags, batch_size, shuffle=False, flatten=flatten)
+    return train, validation
@@ -7,7 +7,8 @@ import argparse
 import os
 import numpy as np
 import pandas as pd
-from data.data import process_data_series,process_data_datetime
+from data.data import process_data_series,process_data_datetime,create_manifest,save_manifest
+from data.pipeline import open_flow_stream,get_window_sequences
 from model import model
 from keras.models import Model
 from keras.callbacks import EarlyStopping
@@ -15,7 +16,7 @@ from keras.optimizers import RMSprop
 warnings.filterwarnings("ignore")
 
 
-def train_model(model, X_train, y_train, name, config):
+def train_model(model, X_train, y_train, name, config, manifest=None):
     """train
     train a single model.
 
@@ -25,6 +26,7 @@ def train_model(model, X_train, y_train, name, config):
         y_train: ndarray(number, ), result data for train.
         name: String, name of model.
         config: Dict, parameter for train.
+        manifest: Dict, saved next to the model so it can be loaded with matching inputs.
     """
     model.compile(loss="mse", optimizer="rmsprop", metrics=['mape'])
     # early = EarlyStopping(monitor='val_loss', patience=30, verbose=0, mode='auto')
@@ -34,12 +36,52 @@ def train_model(model, X_train, y_train, name, config):
         epochs=config["epochs"],
         validation_split=0.05)
 
-    model.save(os.path.join(os.path.dirname(__file__),'model',f'{name}.h5'))
+    save_model(model, hist, name, manifest)
+
+
+def train_stream(model, train_sequence, validation_sequence, name, config, manifest=None):
+    """train
+    train a single model on batches streamed from a Sequence.
+
+    # Arguments
+        model: Model, NN model to train.
+        train_sequence: Sequence, batches of input and result data for train.
+        validation_sequence: Sequence, batches held out for validation.
+        name: String, name of model.
+        config: Dict, parameter for train.
+        manifest: Dict, saved next to the model so it can be loaded with matching inputs.
+    """
+    model.compile(loss="mse", optimizer="rmsprop", metrics=['mape'])
+    # worker threads put the next batches together while the current one trains
+    hist = model.fit(
+        train_sequence,
+        validation_data=validation_sequence,
+        epochs=config["epochs"],
+        workers=config["workers"],
+        max_queue_size=config["queue"])
+
+    save_model(model, hist, name, manifest)
+
+
+def save_model(model, hist, name, manifest=None):
+    """save
+    save a trained model with its manifest and loss history.
+
+    # Arguments
+        model: Model, trained NN model.
+        hist: History, result of fit.
+        name: String, name of model.
+        manifest: Dict, saved next to the model so it can be loaded with matching inputs.
+    """
+    model_path = os.path.join(os.path.dirname(__file__),'model',f'{name}.h5')
+    model.save(model_path)
+    if manifest is not None:
+        save_manifest(model_path, manifest)
     df = pd.DataFrame.from_dict(hist.history)
     df.to_csv(os.path.join(os.path.dirname(__file__),'model',f'{name} loss.csv'), encoding='utf-8', index=False)
 
 
-def train_seas(models, X_train, y_train, name, config):
+def train_seas(models, X_train, y_train, name, config, manifest=None):
     """train
     train the SAEs model.
 
@@ -49,6 +91,7 @@ def train_seas(models, X_train, y_train, name, config):
         y_train: ndarray(number, ), result data for train.
         name: String, name of model.
         config: Dict, parameter for train.
+        manifest: Dict, saved next to the model so it can be loaded with matching inputs.
     """
 
     temp = X_train
@@ -75,16 +118,19 @@ def train_seas(models, X_train, y_train, name, config):
         weights = models[i].get_layer('hidden').get_weights()
         saes.get_layer('hidden%d' % (i + 1)).set_weights(weights)
 
-    train_model(saes, X_train, y_train, name, config)
+    train_model(saes, X_train, y_train, name, config, manifest)
 
 def main(argv):
     lag = 12
-    config = {"batch": 128, "epochs": 10}
+    config = {"batch": 128, "epochs": 10, "workers": 4, "queue": 16}
     file1 = os.path.join(os.path.dirname(__file__),'data','train-data.csv')
     file2 = os.path.join(os.path.dirname(__file__),'data','test-data.csv')
 
-    X_train_series, y_train_series, _, _, _,_,_,_,_,_ = process_data_series(file1, file2, lag)
-    X_train_datetime, y_train_datetime, _, _, _,_,_,_,_,_,_,_ = process_data_datetime(file1, file2)
+    # the series models stream shuffled windows from a memory mapped copy of the scaled flows
+    # the scalers and input layout are saved with each model so the predictor doesn't need the training data
+    stream, scalers = open_flow_stream(file1)
+    series_features = [f'flow t-{lag - i}' for i in range(lag)] + ['scats']
+    datetime_features = ['day', 'time', 'scats']
 
     # train each type of model
     models_types = ['rnn']
@@ -92,29 +138,38 @@ def main(argv):
     for model_type in models_types:
         model_name = model_type if test_identifier == '' else f"{model_type} ({test_identifier})"
         if model_type == 'lstm':
-            X_train_series = np.reshape(X_train_series, (X_train_series.shape[0], X_train_series.shape[1], 1))
+            train_sequence, validation_sequence = get_window_sequences(stream, lag, config["batch"])
             m = model.get_lstm([lag + 1, 64,64, 1])
-            train_model(m, X_train_series, y_train_series, model_name, config)
+            manifest = create_manifest(model_type, lag, 'series', series_features, (lag + 1, 1), scalers, [file1, file2])
+            train_stream(m, train_sequence, validation_sequence, model_name, config, manifest)
         if model_type == 'rnn':
-            X_train_series = np.reshape(X_train_series, (X_train_series.shape[0], X_train_series.shape[1], 1))
+            train_sequence, validation_sequence = get_window_sequences(stream, lag, config["batch"])
             m = model.get_rnn([lag + 1, 64,64, 1])
-            train_model(m, X_train_series, y_train_series, model_name, config)
+            manifest = create_manifest(model_type, lag, 'series', series_features, (lag + 1, 1), scalers, [file1, file2])
+            train_stream(m, train_sequence, validation_sequence, model_name, config, manifest)
         if model_type == 'gru':
-            X_train_series = np.reshape(X_train_series, (X_train_series.shape[0], X_train_series.shape[1], 1))
+            train_sequence, validation_sequence = get_window_sequences(stream, lag, config["batch"])
             m = model.get_gru([lag + 1, 64,64, 1])
-            train_model(m, X_train_series, y_train_series, model_name, config)
+            manifest = create_manifest(model_type, lag, 'series', series_features, (lag + 1, 1), scalers, [file1, file2])
+            train_stream(m, train_sequence, validation_sequence, model_name, config, manifest)
         if model_type == 'saes':
+            # each auto encoder trains on the outputs of the one before so the windows are loaded into memory
+            X_train_series, y_train_series, _, _, _,_,_,_,_,_ = process_data_series(file1, file2, lag)
             X_train_series = np.reshape(X_train_series, (X_train_series.shape[0], X_train_series.shape[1]))
             m = model.get_saes([lag + 1, 400, 400, 400, 1])
-            train_seas(m, X_train_series, y_train_series, model_name, config)
+            manifest = create_manifest(model_type, lag, 'series', series_features, X_train_series.shape[1:], scalers, [file1, file2])
+            train_seas(m, X_train_series, y_train_series, model_name, config, manifest)
         if model_type == 'new_saes':
-            X_train_series = np.reshape(X_train_series, (X_train_series.shape[0], X_train_series.shape[1], 1))
+            train_sequence, validation_sequence = get_window_sequences(stream, lag, config["batch"])
             m = model.get_new_saes(lag + 1,1,encoder_size=10,auto_encoder_count=3, fine_tuning_layers=[10])
-            train_model(m, X_train_series, y_train_series, model_name, config)
+            manifest = create_manifest(model_type, lag, 'series', series_features, (lag + 1, 1), scalers, [file1, file2])
+            train_stream(m, train_sequence, validation_sequence, model_name, config, manifest)
         if model_type == 'average':
+            X_train_datetime, y_train_datetime, _, _, _,_,_,_,_,_,_,_ = process_data_datetime(file1, file2)
             X_train_datetime = np.reshape(X_train_datetime, (X_train_datetime.shape[0], X_train_datetime.shape[1]))
             m = model.get_average([3, 400,400, 400,1])
-            train_model(m, X_train_datetime, y_train_datetime, model_name, config)
+            manifest = create_manifest(model_type, lag, 'datetime', datetime_features, X_train_datetime.shape[1:], scalers, [file1, file2])
+            train_model(m, X_train_datetime, y_train_datetime, model_name, config, manifest)
 
 if __name__ == '__main__':
     main(sys.argv)
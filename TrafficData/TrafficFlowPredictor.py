@@ -6,13 +6,30 @@ import string
 import os
 import datetime
 import math
+import json
+import logging
+import threading
 
 from sklearn.preprocessing import MinMaxScaler
-from TrafficData.SingleModelScats.data.data import process_data_datetime,process_data_series
+from TrafficData.SingleModelScats.data.data import process_data_datetime,process_data_series,load_manifest,scaler_from_dict,hash_dataset,get_datetime_features
 from tensorflow.keras.losses import MeanSquaredError
 from fix_model import load_model_without_time_major
+from TrafficData.InferenceQueue import InferenceQueue
+from TrafficData.NumpyInference import NumpyModel
+from TrafficData.CompiledInference import CompiledModel
+from metrics import PREDICTIONS_ISSUED, PREDICT_TRAFFIC_FLOW_SECONDS, PREDICT_TRAFFIC_FLOWS_SECONDS, MODEL_INFERENCE_SECONDS, MODEL_LOAD_SECONDS
 warnings.filterwarnings("ignore")
 
+logger = logging.getLogger(__name__)
+
+SLOT_MINUTES = 15 # the flow table holds one prediction for each 15 minute interval
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+FLOW_TABLE_FILE = os.path.join(os.path.dirname(__file__),'SingleModelScats','model','flow_table.npy')
+SERIES_CUBE_FILE = os.path.join(os.path.dirname(__file__),'SingleModelScats','data','series_cube.npy')
+SERIES_CUBE_DAYS = 31 # the series inputs are looked up by day of the month
+INFERENCE_BATCH_SIZE = int(os.environ.get('TRAFFIC_INFERENCE_BATCH_SIZE', 256)) # most samples in one model call, 1 calls the models directly
+INFERENCE_WAIT_MS = float(os.environ.get('TRAFFIC_INFERENCE_WAIT_MS', 2)) # how long concurrent requests are collected for before a model call
+
 def custom_load_model(path):
     return load_model_without_time_major(path)
 
@@ -25,39 +42,178 @@ class TrafficFlowModelsEnum(Enum):
     AVERAGE = 'average'
 
 
+# the backend selects how predictions are made
+# keras runs the models for every request, table looks them up in the precomputed flow table,
+# numpy runs the same models with their weights copied into the numpy forward passes of NumpyInference,
+# compiled calls the keras models through the traced fixed batch size functions of CompiledInference
+# keras, numpy and compiled model calls go through an inference queue for each model so concurrent requests are predicted together
 class TrafficFlowPredictor():
-    def __init__(self):
+    def __init__(self, backend: string = None, flow_table_file: string = FLOW_TABLE_FILE, series_cube_file: string = SERIES_CUBE_FILE, inference_batch_size: int = INFERENCE_BATCH_SIZE, inference_wait_ms: float = INFERENCE_WAIT_MS):
         self.models = {}
+        self.model_locks = {}
+        self.model_locks_lock = threading.Lock()
+        self.backend = backend or os.environ.get('TRAFFIC_PREDICTOR_BACKEND', 'keras')
+
+        self.inference_queues = {}
+        self.inference_batch_size = inference_batch_size
+        self.inference_wait_ms = inference_wait_ms
+        self.inference_queues_lock = threading.Lock()
 
         self.flow_scaler:MinMaxScaler = None
         self.days_scaler:MinMaxScaler = None
         self.scats_scaler:MinMaxScaler = None
         self.times_scaler:MinMaxScaler = None
         
-        self.lags = 12 # must match whatever the models were trained on
+        self.lags = 12 # must match whatever the models were trained on, the model manifests override it
+
+        # manifests saved with the models by train.py, None for models saved without one
+        self.manifests = {}
+        self.dataset_hash = None
+        self.refused_models = {} # why each refused model was refused, raised for its predictions
 
         self.file1 = os.path.join(os.path.dirname(__file__),'SingleModelScats','data','train-data.csv')
         self.file2 = os.path.join(os.path.dirname(__file__),'SingleModelScats','data','test-data.csv')
 
-        self.get_scalars()
-        self.get_lookup_data()
-        
-        self.location_series_data = {}
+        self.series_cube_file = series_cube_file
+        self.series_cube = None
+        self.series_cube_error = None # why the series data was refused, raised for series requests
+
+        if self.backend == 'table':
+            # the table already holds the model outputs so the training data isn't needed
+            self.load_flow_table(flow_table_file)
+        elif self.backend in ('keras', 'numpy', 'compiled'):
+            # older models have no manifest, their scalers are refitted from the training data
+            if not self.load_manifests():
+                self.get_scalars()
+            self.get_lookup_data()
+        else:
+            raise ValueError(f"Unknown predictor backend: {self.backend}")
+
+    def load_flow_table(self, file: string):
+        # the table is memory mapped so processes serving requests share the same pages
+        self.flow_table = np.load(file, mmap_mode='r')
+        with open(os.path.splitext(file)[0] + '.json') as metadata_file:
+            metadata = json.load(metadata_file)
+        self.flow_table_models = {model_name: i for i, model_name in enumerate(metadata['models'])}
+        self.flow_table_sites = {site: i for i, site in enumerate(metadata['sites'])}
+
+    def lookup_traffic_flows(self,requests: list,steps:int,model_name: string):
+        # sum the flow table over the steps following each date, the steps don't run past the end of the day
+        # a single request for a location missing from the table raises, in a batch its flow is nan
+        model_index = self.flow_table_models.get(model_name)
+        if model_index is None:
+            return np.full(len(requests), self.get_default_prediction() * steps, dtype=np.float64)
+
+        site_indices = np.array([self.flow_table_sites.get(int(location), -1) for location, _ in requests], dtype=np.int64)
+        missing = site_indices < 0
+        if len(requests) == 1 and missing[0]:
+            raise Exception(f"No Data exists for location {requests[0][0]}")
+        site_indices[missing] = 0
+
+        days = np.array([date.weekday() for _, date in requests])
+        slots = np.array([(date.hour * 60 + date.minute) // SLOT_MINUTES for _, date in requests])
+        cumulative = np.cumsum(self.flow_table[model_index, site_indices, days], axis=1, dtype=np.float64)
+        cumulative = np.concatenate([np.zeros((len(requests), 1)), cumulative], axis=1)
+        rows = np.arange(len(requests))
+        flows = cumulative[rows, np.minimum(slots + steps, SLOTS_PER_DAY)] - cumulative[rows, slots]
+        flows[missing] = np.nan
+        return flows
+
+    def get_model_path(self,model_name:string):
+        return os.path.join(os.path.dirname(__file__),'SingleModelScats','model',f'{model_name}.h5')
 
     def get_model(self,model_name:string):
+        model = self.models.get(model_name)
+        if model is not None or model_name in self.refused_models:
+            return model
+
+        # each model is loaded under its own lock so concurrent first requests load it once
+        with self.model_locks_lock:
+            model_lock = self.model_locks.setdefault(model_name, threading.Lock())
         try:
-            if self.models.get(model_name) == None:
-                model_path = os.path.join(os.path.dirname(__file__),'SingleModelScats','model',f'{model_name}.h5')
-                if os.path.exists(model_path):
-                    self.models[model_name] = custom_load_model(model_path)
-                else:
-                    print(f"Model file not found: {model_path}")
-                    return None
-            return self.models.get(model_name)
+            with model_lock:
+                if self.models.get(model_name) == None and model_name not in self.refused_models:
+                    model_path = self.get_model_path(model_name)
+                    if os.path.exists(model_path):
+                        with MODEL_LOAD_SECONDS.time(model=model_name):
+                            model = custom_load_model(model_path)
+                        try:
+                            self.check_manifest(model_name,model)
+                        except ValueError as e:
+                            self.refused_models[model_name] = str(e)
+                            raise
+                        if self.backend == 'numpy':
+                            model = NumpyModel.from_keras(model)
+                        elif self.backend == 'compiled':
+                            model = CompiledModel(model)
+                        self.models[model_name] = model
+                    else:
+                        logger.warning("Model file not found: %s", model_path)
+                        return None
+                return self.models.get(model_name)
         except Exception as e:
-            print(f"Error loading model: {str(e)}")
+            logger.error("Error loading model: %s", str(e))
             return None
 
+    def get_manifest(self,model_name:string):
+        if model_name not in self.manifests:
+            self.manifests[model_name] = load_manifest(self.get_model_path(model_name))
+        return self.manifests[model_name]
+
+    def load_manifests(self):
+        # take the scalers and lags from the first model with a manifest instead of processing the training data
+        for model in TrafficFlowModelsEnum:
+            manifest = self.get_manifest(model.value)
+            if manifest is None:
+                continue
+            scalers = manifest['scalers']
+            self.flow_scaler = scaler_from_dict(scalers['flow'])
+            self.scats_scaler = scaler_from_dict(scalers['scats'])
+            self.days_scaler = scaler_from_dict(scalers['days'])
+            self.times_scaler = scaler_from_dict(scalers['times'])
+            self.lags = manifest['lags']
+            self.dataset_hash = manifest['dataset']['sha256']
+            logger.info("Loaded scalers from the %s model manifest", model.value)
+            return True
+        return False
+
+    def check_manifest(self,model_name:string,model):
+        # refuse models trained on different data or inputs than the predictor prepares
+        manifest = self.get_manifest(model_name)
+        if manifest is None:
+            if self.dataset_hash is not None:
+                logger.warning("Model %s has no manifest, assuming it matches the other models", model_name)
+            return
+
+        if self.dataset_hash is not None and manifest['dataset']['sha256'] != self.dataset_hash:
+            raise ValueError(f"Model {model_name} was trained on a different dataset")
+        scalers = {'flow': self.flow_scaler, 'scats': self.scats_scaler, 'days': self.days_scaler, 'times': self.times_scaler}
+        for name, parameters in manifest['scalers'].items():
+            scaler = scalers.get(name)
+            if scaler is None or not (np.allclose(scaler.min_, parameters['min']) and np.allclose(scaler.scale_, parameters['scale'])):
+                raise ValueError(f"Model {model_name} was trained with a different {name} scaler")
+        if manifest['inputs'] == 'series' and manifest['lags'] != self.lags:
+            raise ValueError(f"Model {model_name} was trained with {manifest['lags']} lags, not {self.lags}")
+        if manifest['input_shape'][0] != model.input_shape[1]:
+            raise ValueError(f"Model {model_name} expects {model.input_shape[1]} inputs, its manifest lists {manifest['input_shape'][0]}")
+
+    def check_refused(self,model_name:string):
+        # a model refused by its manifest fails its predictions, only a missing model file falls back to the default flow
+        if model_name in self.refused_models:
+            raise Exception(self.refused_models[model_name])
+
+    def get_inference_queue(self,model_name:string):
+        # the model wrapped in its inference queue, or the model itself when batching is turned off
+        model = self.get_model(model_name)
+        if model is None or self.inference_batch_size <= 1:
+            return model
+        with self.inference_queues_lock:
+            inference_queue = self.inference_queues.get(model_name)
+            if inference_queue is None:
+                inference_queue = InferenceQueue(model, model_name, self.inference_batch_size, self.inference_wait_ms / 1000)
+                self.inference_queues[model_name] = inference_queue
+            return inference_queue
+
     def get_default_prediction(self):
         # Return a reasonable default prediction when model is not available
         return 400  # Average flow rate
@@ -67,7 +223,7 @@ class TrafficFlowPredictor():
             if os.path.exists(self.file1) and os.path.exists(self.file2):
                 _, _, _, _,_,_,_,_,self.flow_scaler, self.scats_scaler,self.days_scaler,self.times_scaler = process_data_datetime(self.file1, self.file2)
             else:
-                print("Training data files not found. Using default scalers.")
+                logger.warning("Training data files not found. Using default scalers.")
                 self.flow_scaler = MinMaxScaler()
                 self.scats_scaler = MinMaxScaler()
                 self.days_scaler = MinMaxScaler()
@@ -78,49 +234,160 @@ class TrafficFlowPredictor():
                 self.days_scaler.fit([[0], [6]])  # Days 0-6
                 self.times_scaler.fit([[0], [1439]])  # Minutes in a day (0-1439)
         except Exception as e:
-            print(f"Error loading scalers: {str(e)}. Using default values.")
+            logger.error("Error loading scalers: %s. Using default values.", str(e))
 
     def get_lookup_data(self):
+        # the series inputs come from the cube built from the training data
+        # with a manifest the cube has to be built from the dataset the models were trained on, the data files are only
+        # hashed when the cube is missing or stale and it is rebuilt if they are that dataset, otherwise the series data
+        # is refused, without a manifest the cube is rebuilt whenever the data files change
         try:
-            if os.path.exists(self.file1) and os.path.exists(self.file2):
-                _, _, _, _,self.series_data,_,_,_,_,_ = process_data_series(self.file1, self.file2,self.lags)
-            else:
-                print("Training data files not found. Using empty series data.")
-                self.series_data = []
+            if self.dataset_hash is not None:
+                if self.load_series_cube(self.dataset_hash):
+                    return
+                if not os.path.exists(self.file1) or not os.path.exists(self.file2) or hash_dataset(self.file1, self.file2) != self.dataset_hash:
+                    raise ValueError("The training data differs from the dataset the models were trained on")
+                self.build_series_cube(self.dataset_hash)
+            elif os.path.exists(self.file1) and os.path.exists(self.file2):
+                dataset_hash = hash_dataset(self.file1, self.file2)
+                if not self.load_series_cube(dataset_hash):
+                    self.build_series_cube(dataset_hash)
+            elif not self.load_series_cube(None):
+                logger.warning("Training data files not found. Using empty series data.")
+        except ValueError as e:
+            logger.error("Refusing the series data: %s", str(e))
+            self.series_cube = None
+            self.series_cube_error = str(e)
         except Exception as e:
-            print(f"Error loading lookup data: {str(e)}. Using empty series data.")
-            self.series_data = []
-        
-        
+            logger.error("Error loading lookup data: %s. Using empty series data.", str(e))
+            self.series_cube = None
+
+    def build_series_cube(self,dataset_hash: string):
+        _, _, _, _,series_data,_,_,_,_,scats_scaler = process_data_series(self.file1, self.file2,self.lags)
+        sites = np.rint(scats_scaler.inverse_transform(series_data[:, [self.lags]])[:, 0]).astype(np.int64)
+        build_series_cube(series_data, sites, self.lags, self.series_cube_file, dataset_hash)
+        self.load_series_cube(dataset_hash)
+
+    def get_series_cube_metadata(self):
+        metadata_path = os.path.splitext(self.series_cube_file)[0] + '.json'
+        if not os.path.exists(self.series_cube_file) or not os.path.exists(metadata_path):
+            return None
+        with open(metadata_path) as metadata_file:
+            return json.load(metadata_file)
+
+    def load_series_cube(self,dataset_hash: string):
+        # memory map the cube if it was built from the same data with the same lags, any data is accepted without a hash
+        metadata = self.get_series_cube_metadata()
+        if metadata is None:
+            return False
+        if metadata['lags'] != self.lags or (dataset_hash is not None and metadata['dataset_sha256'] != dataset_hash):
+            return False
+
+        self.series_cube = np.load(self.series_cube_file, mmap_mode='r')
+        self.series_cube_sites = {site: i for i, site in enumerate(metadata['sites'])}
+        valid = np.unpackbits(np.load(os.path.splitext(self.series_cube_file)[0] + '_valid.npy'), axis=2, count=SLOTS_PER_DAY).astype(bool)
+
+        # the intervals with data on each day and the day each day of the month is looked up on
+        # days without data fall back to the same weekday of an earlier week
+        self.series_cube_slots = valid.sum(axis=2)
+        has_data = valid.any(axis=2)
+        self.series_cube_days = np.full((len(self.series_cube_sites), SERIES_CUBE_DAYS + 1), -1, dtype=np.int64)
+        for day in range(1, SERIES_CUBE_DAYS + 1):
+            earlier = self.series_cube_days[:, day - 7] if day > 7 else -1
+            self.series_cube_days[:, day] = np.where(has_data[:, day - 1], day - 1, earlier)
+        return True
+
     def predict_traffic_flow(self,location: int,date: datetime,steps:int,model_name: string):
-        model = self.get_model(model_name)
+        PREDICTIONS_ISSUED.inc(model=model_name)
+        with PREDICT_TRAFFIC_FLOW_SECONDS.time(model=model_name):
+            if self.backend == 'table':
+                return self.lookup_traffic_flows([(location, date)],steps,model_name)[0]
+
+            model = self.get_inference_queue(model_name)
         
-        if model is None:
-            # Use default prediction when model is not available
-            return self.get_default_prediction() * steps
+            if model is None:
+                self.check_refused(model_name)
+                # Use default prediction when model is not available
+                return self.get_default_prediction() * steps
             
-        X = None
-        if model_name == "average":
-            X = self.get_datetime_inputs(location,date,steps)
-            if X is None: return 0
-            y_pred = self.predict_datetime(model,X)
-        else:
-            X = self.get_timeseries_inputs(location,date,steps)
-            if X is None: return 0
-            y_pred = self.predict_series(model,X)
+            X = None
+            if model_name == "average":
+                X = self.get_datetime_inputs(location,date,steps)
+                if X is None: return 0
+                with MODEL_INFERENCE_SECONDS.time(model=model_name):
+                    y_pred = self.predict_datetime(model,X)
+            else:
+                X = self.get_timeseries_inputs(location,date,steps)
+                if X is None: return 0
+                with MODEL_INFERENCE_SECONDS.time(model=model_name):
+                    y_pred = self.predict_series(model,X)
         
-        return y_pred.sum()
+            return y_pred.sum()
+
+    # predict the flow for many (location, date) pairs with a single model call
+    # returns an array with the summed flow over the steps for each pair, nan for locations without data
+    # so one unknown site in a batch doesn't fail the predictions of the rest
+    def predict_traffic_flows(self,requests: list,steps:int,model_name: string):
+        PREDICTIONS_ISSUED.inc(len(requests), model=model_name)
+        with PREDICT_TRAFFIC_FLOWS_SECONDS.time(model=model_name):
+            if self.backend == 'table':
+                return self.lookup_traffic_flows(requests,steps,model_name)
+
+            model = self.get_inference_queue(model_name)
+
+            if model is None:
+                self.check_refused(model_name)
+                # Use default prediction when model is not available
+                return np.full(len(requests), self.get_default_prediction() * steps, dtype=np.float64)
+
+            flows = np.zeros(len(requests), dtype=np.float64)
+            inputs, indices, lengths = [], [], []
+            if model_name == "average":
+                # the datetime inputs for every request are made together
+                inputs.append(self.get_datetime_inputs_batch(requests,steps))
+                indices = list(range(len(requests)))
+                lengths = [steps] * len(requests)
+            else:
+                for i, (location, date) in enumerate(requests):
+                    if self.series_cube is None or int(location) not in self.series_cube_sites:
+                        flows[i] = np.nan
+                        continue
+                    X = self.get_timeseries_inputs(location,date,steps)
+                    if X is None: continue
+                    inputs.append(X)
+                    indices.append(i)
+                    lengths.append(len(X))
+
+            if len(inputs) == 0:
+                return flows
+
+            X = np.concatenate(inputs)
+            with MODEL_INFERENCE_SECONDS.time(model=model_name):
+                if model_name == "average":
+                    y_pred = self.predict_datetime(model,X)
+                else:
+                    y_pred = self.predict_series(model,X)
+
+            # sum the steps belonging to each request
+            offsets = np.cumsum([0] + lengths[:-1])
+            flows[indices] = np.add.reduceat(y_pred, offsets)
+            return flows
 
     def get_datetime_inputs(self,location: int,date:datetime,steps:int):
-        dayindex = date.weekday() # determine weekday
-        actual_time = date.hour * 60 + date.minute # determine time in minutes
-        rounded_time = 15 * math.floor(actual_time / 15) # get current 15 minute interval
+        return self.get_datetime_inputs_batch([(location, date)],steps)
 
-        days = self.days_scaler.transform(np.array([dayindex for _ in range(steps)]).reshape(-1,1)).reshape(1,-1)[0]
-        times = self.times_scaler.transform(np.array([actual_time + t*15 for t in range(steps)]).reshape(-1,1)).reshape(1,-1)[0]
-        scats = self.scats_scaler.transform(np.array([location for _ in range(steps)]).reshape(-1,1)).reshape(1,-1)[0]
+    def get_datetime_inputs_batch(self,requests: list,steps:int):
+        # the inputs for each (location, date) request, steps rows each, one for each following 15 minutes of the same day
+        days, times = get_datetime_features(np.array([np.datetime64(date, 'm') for _, date in requests]))
+        days = np.repeat(days, steps)
+        times = (times[:, np.newaxis] + 15 * np.arange(steps)).reshape(-1)
+        scats = np.repeat(np.array([int(location) for location, _ in requests]), steps)
 
-        X = np.array([np.array([days[i],times[i],scats[i]]) for i in range(steps)])
+        X = np.column_stack([
+            self.days_scaler.transform(days.reshape(-1,1))[:, 0],
+            self.times_scaler.transform(times.reshape(-1,1))[:, 0],
+            self.scats_scaler.transform(scats.reshape(-1,1))[:, 0]
+        ])
         X = np.reshape(X, (X.shape[0], X.shape[1], 1))
         return X
 
@@ -129,40 +396,25 @@ class TrafficFlowPredictor():
         y_pred = self.flow_scaler.inverse_transform(y_pred.reshape(-1, 1)).reshape(1, -1)[0]
         return y_pred
 
-    def lookup_location_data(self,location:int):
-        scaled_location = self.scats_scaler.transform(np.array([location]).reshape(-1,1)).reshape(1,-1)[0][0]
-        if self.location_series_data.get(location) is None:
-            location_indices = [i for i in range(len(self.series_data)) if self.series_data[i][self.lags] == scaled_location]
-            self.location_series_data[location] = self.series_data[location_indices]
-    
-        return self.location_series_data[location]
-        
     def get_timeseries_inputs(self,location: int,date:datetime,steps:int):
-        day = date.day
-        actual_time = date.hour * 60 + date.minute # determine time in minutes
-        rounded_time = 15 * math.floor(actual_time / 15) # get current 15 minute interval
-        time_index = int(rounded_time / 15)
-        
-        location_X = self.lookup_location_data(location)
-        if len(location_X) == 0:
+        time_index = (date.hour * 60 + date.minute) // 15 # get current 15 minute interval
+
+        if self.series_cube_error is not None:
+            raise Exception(self.series_cube_error)
+        site_index = self.series_cube_sites.get(int(location)) if self.series_cube is not None else None
+        if site_index is None:
             raise Exception(f"No Data exists for location {location}")
-        
-        day_X = location_X[(day-1)*96:day*96]
-        
-        # fix for bad data having incomplete days
-        while len(day_X) == 0 and day >= 0:
-            day -= 7
-            day_X = location_X[(day-1)*96:day*96]
 
-        if len(day_X) == 0:
+        day = self.series_cube_days[site_index, date.day]
+        if day < 0:
             return None
 
-        # Handle case where time_index + steps would exceed array bounds
-        available_steps = min(steps, len(day_X) - time_index)
+        # Handle case where time_index + steps would exceed the data for the day
+        available_steps = min(steps, self.series_cube_slots[site_index, day] - time_index)
         if available_steps <= 0:
             return None
-            
-        X = np.array([day_X[time_index + i] for i in range(available_steps)])
+
+        X = self.series_cube[site_index, day, time_index:time_index + available_steps]
         X = np.reshape(X, (X.shape[0], X.shape[1], 1))
         return X
 
@@ -170,3 +422,78 @@ class TrafficFlowPredictor():
         y_pred = model.predict(X)
         y_pred = self.flow_scaler.inverse_transform(y_pred.reshape(-1, 1)).reshape(1, -1)[0]
         return y_pred
+
+
+# the predictor shared by every request and route search in the process
+# it is created once on first use so the training data is only processed and each model only loaded once
+_predictor: TrafficFlowPredictor = None
+_predictor_lock = threading.Lock()
+
+def get_predictor() -> TrafficFlowPredictor:
+    global _predictor
+    with _predictor_lock:
+        if _predictor is None:
+            _predictor = TrafficFlowPredictor()
+        return _predictor
+
+# lay the series inputs out as a dense [site, day, interval, feature] float32 cube saved as a memory mapped .npy
+# each site's rows are in order from the first day of the month with one row per 15 minute interval,
+# the intervals that have a row are saved as a [site, day, interval] bitmap alongside the cube
+# the files are written under temporary names and moved into place, metadata last, so processes that have the old cube
+# mapped keep reading it and workers building the cube at the same time don't write over each other
+def build_series_cube(series_data: np.ndarray, sites: np.ndarray, lags: int, file: string = SERIES_CUBE_FILE, dataset_hash: string = None):
+    cube_sites, site_indices = np.unique(sites, return_inverse=True)
+    counts = np.bincount(site_indices, minlength=len(cube_sites))
+    order = np.argsort(site_indices, kind='stable')
+    positions = np.empty(len(order), dtype=np.int64)
+    positions[order] = np.arange(len(order)) - np.repeat(np.cumsum(counts) - counts, counts)
+    keep = positions < SERIES_CUBE_DAYS * SLOTS_PER_DAY
+    site_indices, positions = site_indices[keep], positions[keep]
+
+    path = os.path.splitext(file)[0]
+    temporary = path + f'.{os.getpid()}.tmp'
+    cube = np.lib.format.open_memmap(temporary + '.npy', mode='w+', dtype=np.float32, shape=(len(cube_sites), SERIES_CUBE_DAYS, SLOTS_PER_DAY, series_data.shape[1]))
+    cube[site_indices, positions // SLOTS_PER_DAY, positions % SLOTS_PER_DAY] = series_data[keep]
+    cube.flush()
+    del cube
+
+    valid = np.zeros((len(cube_sites), SERIES_CUBE_DAYS, SLOTS_PER_DAY), dtype=bool)
+    valid[site_indices, positions // SLOTS_PER_DAY, positions % SLOTS_PER_DAY] = True
+    np.save(temporary + '_valid.npy', np.packbits(valid, axis=2))
+    with open(temporary + '.json', 'w') as metadata_file:
+        json.dump({'sites': [int(site) for site in cube_sites], 'lags': lags, 'slot_minutes': SLOT_MINUTES, 'dataset_sha256': dataset_hash}, metadata_file)
+
+    os.replace(temporary + '.npy', file)
+    os.replace(temporary + '_valid.npy', path + '_valid.npy')
+    os.replace(temporary + '.json', path + '.json')
+
+# run every model over every site for every 15 minute interval of the week and save the flows as a
+# [model, site, weekday, interval] float32 array, the series models look up history by day of the month
+# so each weekday is predicted on its date in the week starting at reference_date
+# the table is built under temporary names and moved into place so servers that have the old table mapped keep reading it
+def build_flow_table(predictor: TrafficFlowPredictor, sites: list, file: string = FLOW_TABLE_FILE, reference_date: datetime.date = datetime.date(2006, 10, 2)):
+    models = [model.value for model in TrafficFlowModelsEnum]
+    temporary = os.path.splitext(file)[0] + f'.{os.getpid()}.tmp'
+    table = np.lib.format.open_memmap(temporary + '.npy', mode='w+', dtype=np.float32, shape=(len(models), len(sites), 7, SLOTS_PER_DAY))
+
+    for model_index, model_name in enumerate(models):
+        for site_index, site in enumerate(sites):
+            requests = []
+            for day in range(7):
+                date = reference_date + datetime.timedelta(days=(day - reference_date.weekday()) % 7)
+                start = datetime.datetime(date.year, date.month, date.day)
+                requests.extend((site, start + datetime.timedelta(minutes=slot * SLOT_MINUTES)) for slot in range(SLOTS_PER_DAY))
+            try:
+                flows = predictor.predict_traffic_flows(requests, 1, model_name)
+            except Exception as e:
+                logger.warning("Unable to predict %s for site %s: %s", model_name, site, str(e))
+                flows = np.zeros(len(requests))
+            # sites without data come back as nan from the batched predictions, they get the same zeros as a failed site
+            table[model_index, site_index] = np.reshape(np.nan_to_num(flows, nan=0.0), (7, SLOTS_PER_DAY))
+
+    table.flush()
+    del table
+    with open(temporary + '.json', 'w') as metadata_file:
+        json.dump({'models': models, 'sites': [int(site) for site in sites], 'slot_minutes': SLOT_MINUTES, 'reference_date': reference_date.isoformat()}, metadata_file)
+    os.replace(temporary + '.npy', file)
+    os.replace(temporary + '.json', os.path.splitext(file)[0] + '.json')
@@ -1,12 +1,20 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response
 import route_finding as router
+import travel_times
+import numpy as np
 import datetime
 from TrafficData.TrafficFlowPredictor import *
+from metrics import render_metrics, CONTENT_TYPE
 from flask_cors import CORS
 
 app = Flask(__name__)
 CORS(app)
 
+# one predictor for the whole process, loaded at startup and shared with the router
+predictor = get_predictor()
+
+MAX_ROUTE_BATCH_SIZE = 1000 # most queries accepted by /routes/batch
+
 def parse_date(date_string):
     try:
         date, time = date_string.split()
@@ -36,6 +44,164 @@ def get_routes():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/routes/batch', methods=['POST'])
+def get_routes_batch():
+    data = request.get_json() or {}
+    items = data.get('queries')
+
+    if not isinstance(items, list) or len(items) == 0:
+        return jsonify({"error": "Please provide a list of queries"}), 400
+    if len(items) > MAX_ROUTE_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_ROUTE_BATCH_SIZE} queries can be routed at once"}), 400
+
+    # malformed queries are reported in place without stopping the rest of the batch
+    queries = []
+    results = [None] * len(items)
+    for i, item in enumerate(items):
+        try:
+            src, dest = int(item['source']), int(item['destination'])
+        except (KeyError, TypeError, ValueError):
+            results[i] = {"error": "Please provide source and destination"}
+            continue
+        date_string = item.get('datetime')
+        date = parse_date(date_string) if date_string else datetime.datetime.now()
+        queries.append((i, (src, dest, date, item.get('model', TrafficFlowModelsEnum.LSTM.value))))
+
+    try:
+        batch = travel_times.find_routes_batch([query for _, query in queries])
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    for (i, (src, dest, date, model_type)), (routes, error) in zip(queries, batch):
+        result = {
+            "source": src,
+            "destination": dest,
+            "datetime": date.strftime('%Y/%m/%d %I:%M:%S'),
+            "model": model_type
+        }
+        if error is not None:
+            result["error"] = error
+        else:
+            result["routes"] = [{
+                "scats": route.list_scats(),
+                "travel_time": round(route.cost * 60, 2),
+                "distance": round(route.calculate_route_distance(), 2)
+            } for route in routes]
+        results[i] = result
+
+    return jsonify({"results": results, "unit": "mins"})
+
+@app.route('/matrix', methods=['POST'])
+def get_matrix():
+    data = request.get_json() or {}
+
+    origins = data.get('origins')
+    date_string = data.get('datetime')
+    model_type = data.get('model', TrafficFlowModelsEnum.LSTM.value)
+
+    date = parse_date(date_string) if date_string else datetime.datetime.now()
+
+    try:
+        origins, destinations, matrix = travel_times.calculate_travel_time_matrix(date, model_type, origins)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    # convert hours to minutes, unreachable destinations are null
+    minutes = np.round(matrix * 60, 2)
+    return jsonify({
+        "datetime": date.strftime('%Y/%m/%d %I:%M:%S'),
+        "model": model_type,
+        "origins": origins,
+        "destinations": destinations,
+        "matrix": [[None if np.isinf(t) else float(t) for t in row] for row in minutes],
+        "unit": "mins"
+    })
+
+@app.route('/isochrone', methods=['POST'])
+def get_isochrone():
+    data = request.get_json() or {}
+
+    src = data.get('source')
+    budget = data.get('minutes')
+    date_string = data.get('datetime')
+    model_type = data.get('model', TrafficFlowModelsEnum.LSTM.value)
+
+    if not src or budget is None:
+        return jsonify({"error": "Please provide source and minutes"}), 400
+
+    date = parse_date(date_string) if date_string else datetime.datetime.now()
+
+    try:
+        sites = travel_times.calculate_isochrone(int(src), date, model_type, float(budget))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify({
+        "source": src,
+        "datetime": date.strftime('%Y/%m/%d %I:%M:%S'),
+        "model": model_type,
+        "minutes": budget,
+        "sites": [{
+            "scats": scats,
+            "travel_time": round(time * 60, 2),
+            "arrival": (date + datetime.timedelta(hours=time)).strftime('%Y/%m/%d %I:%M:%S')
+        } for scats, time in sites],
+        "unit": "mins"
+    })
+
+@app.route('/departures', methods=['POST'])
+def get_departures():
+    data = request.get_json() or {}
+
+    src = data.get('source')
+    dest = data.get('destination')
+    start_string = data.get('start')
+    end_string = data.get('end')
+    interval = data.get('interval', 5)
+    model_type = data.get('model', TrafficFlowModelsEnum.LSTM.value)
+
+    if not src or not dest or not start_string or not end_string:
+        return jsonify({"error": "Please provide source, destination, start and end"}), 400
+
+    start = parse_date(start_string)
+    end = parse_date(end_string)
+
+    try:
+        routes, departures, times = travel_times.sweep_departure_times(int(src), int(dest), start, end, model_type, int(interval))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    if len(routes) == 0:
+        return jsonify({"error": f"No route from {src} to {dest}"}), 404
+
+    # the fastest route for each departure and the departure with the shortest travel time
+    fastest = np.argmin(times, axis=0)
+    best_times = times[fastest, np.arange(len(departures))]
+    best = int(np.argmin(best_times))
+    return jsonify({
+        "source": src,
+        "destination": dest,
+        "model": model_type,
+        "routes": [route.list_scats() for route in routes],
+        "curve": [{
+            "departure": departure.strftime('%Y/%m/%d %I:%M:%S'),
+            "travel_time": round(float(time) * 60, 2),
+            "route": int(route)
+        } for departure, time, route in zip(departures, best_times, fastest)],
+        "best": {
+            "departure": departures[best].strftime('%Y/%m/%d %I:%M:%S'),
+            "travel_time": round(float(best_times[best]) * 60, 2),
+            "route": int(fastest[best])
+        },
+        "unit": "mins"
+    })
+
 @app.route('/predict', methods=['POST'])
 def predict_traffic():
     data = request.get_json()
@@ -50,7 +216,6 @@ def predict_traffic():
     date = parse_date(date_string) if date_string else datetime.datetime.now()
     
     try:
-        predictor = TrafficFlowPredictor()
         flow = predictor.predict_traffic_flow(point, date, 4, model_type)
         
         return jsonify({
@@ -70,5 +235,9 @@ def get_models():
         "models": [model.value for model in TrafficFlowModelsEnum]
     })
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(render_metrics(), mimetype=CONTENT_TYPE)
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -1,9 +1,11 @@
-from flask import Flask, render_template_string, render_template, request, jsonify
+from flask import Flask, render_template_string, render_template, request, jsonify, Response
 import datetime 
 import os
 import csv
-from TrafficData.TrafficFlowPredictor import TrafficFlowPredictor, TrafficFlowModelsEnum
+from TrafficData.TrafficFlowPredictor import TrafficFlowPredictor, TrafficFlowModelsEnum, get_predictor
 import route_finding as router
+from data.road_network import get_traffic_network
+from metrics import render_metrics, CONTENT_TYPE
 
 app = Flask(__name__, static_url_path='/static', static_folder='static')
 
@@ -230,8 +232,8 @@ def index():
     </html>
     ''')
 
-# Initialize predictor
-predictor = None
+# one predictor for the whole process, loaded at startup and shared with the router
+predictor = get_predictor()
 
 @app.route('/generate_routes', methods=['POST'])
 def generate_routes():
@@ -271,7 +273,6 @@ def generate_routes():
 
 @app.route('/predict_flow', methods=['POST'])
 def predict_flow():
-    global predictor
     point = request.form['point']
     date_string = request.form['date']
     model = request.form['model']
@@ -285,10 +286,6 @@ def predict_flow():
         date = datetime.datetime.now()
 
     try:
-        # Initialize predictor on first use
-        if predictor is None:
-            predictor = TrafficFlowPredictor()
-        
         flow = predictor.predict_traffic_flow(point, date, 4, model)
         return jsonify({
             "scats": point,
@@ -310,14 +307,12 @@ def view_routes():
         # Read traffic network data
         scats_data = {}
         if os.path.exists('data/traffic_network2.csv'):
-            with open('data/traffic_network2.csv', newline='') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    scats_data[row['SCATS Number']] = {
-                        'lat': float(row['Latitude']),
-                        'lng': float(row['Longitude']),
-                        'name': row['Site Description']
-                    }
+            for node in get_traffic_network('data/traffic_network2.csv').nodes:
+                scats_data[str(node.scats_number)] = {
+                    'lat': node.latitude,
+                    'lng': node.longitude,
+                    'name': node.name
+                }
         else:
             # Use default values for demonstration
             scats_data = {
@@ -328,6 +323,10 @@ def view_routes():
     except Exception as e:
         return jsonify({"error": f"Error loading routes: {str(e)}"}), 500
 
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype=CONTENT_TYPE)
+
 if __name__ == '__main__':
     print(" * Running on http://127.0.0.1:5000")
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -1,12 +1,16 @@
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, jsonify, request, render_template, Response
 import route_finding as router
 import datetime
 from TrafficData.TrafficFlowPredictor import *
+from metrics import render_metrics, CONTENT_TYPE
 from flask_cors import CORS
 
 app = Flask(__name__)
 CORS(app)
 
+# one predictor for the whole process, loaded at startup and shared with the router
+predictor = get_predictor()
+
 def parse_date(date_string):
     try:
         date, time = date_string.split()
@@ -68,7 +72,6 @@ def predict_traffic():
     date = parse_date(date_string) if date_string else datetime.datetime.now()
     
     try:
-        predictor = TrafficFlowPredictor()
         flow = predictor.predict_traffic_flow(point, date, 4, model_type)
         
         result = {
@@ -103,5 +106,9 @@ def get_models():
     else:
         return render_template('models.html', models=models)
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(render_metrics(), mimetype=CONTENT_TYPE)
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,67 @@
+import argparse
+import os
+import time
+import numpy as np
+from fix_model import load_model_without_time_major
+from TrafficData.CompiledInference import CompiledModel
+from TrafficData.NumpyInference import NumpyModel
+
+MODEL_FOLDER = os.path.join('TrafficData', 'SingleModelScats', 'model')
+BATCH_SIZES = [1, 4, 32, 256]
+
+def time_calls(predict, X: np.ndarray, repeats: int) -> float:
+    # median latency of a call in milliseconds, after one call to warm up
+    predict(X)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict(X)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1000
+
+# compare the per call latency of keras predict, the compiled path and the numpy path for each model
+# run from the repository root: python benchmark_inference.py
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "models",
+        nargs="*",
+        default=['lstm', 'gru', 'rnn', 'saes', 'new_saes', 'average'],
+        help="Models to benchmark")
+    parser.add_argument(
+        "--batch-sizes",
+        type=int,
+        nargs="+",
+        default=BATCH_SIZES,
+        help="Batch sizes to time a call at")
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=50,
+        help="Calls timed for each model and batch size")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'model':<10} {'batch':>6} {'predict ms':>11} {'compiled ms':>12} {'numpy ms':>9} {'max error':>10}")
+    for model_name in args.models:
+        path = os.path.join(MODEL_FOLDER, f'{model_name}.h5')
+        if not os.path.exists(path):
+            print(f"{model_name:<10} no model file")
+            continue
+
+        model = load_model_without_time_major(path)
+        compiled_model = CompiledModel(model)
+        compiled_model.warm_up()
+        numpy_model = NumpyModel.from_keras(model)
+        for batch_size in args.batch_sizes:
+            X = rng.random((batch_size,) + tuple(model.input_shape[1:]), dtype=np.float32)
+            predict_ms = time_calls(lambda X: model.predict(X, verbose=0), X, args.repeats)
+            compiled_ms = time_calls(compiled_model.predict, X, args.repeats)
+            numpy_ms = time_calls(numpy_model.predict, X, args.repeats)
+
+            expected = model.predict(X, verbose=0)
+            error = max(np.max(np.abs(compiled_model.predict(X) - expected)), np.max(np.abs(numpy_model.predict(X) - expected)))
+            print(f"{model_name:<10} {batch_size:>6} {predict_ms:>11.2f} {compiled_ms:>12.2f} {numpy_ms:>9.2f} {error:>10.1e}")
+
+if __name__ == "__main__":
+    main()
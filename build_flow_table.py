@@ -0,0 +1,33 @@
+import argparse
+import csv
+import datetime
+from TrafficData.TrafficFlowPredictor import TrafficFlowPredictor, build_flow_table, FLOW_TABLE_FILE
+
+TRAFFIC_NETWORK_FILE = "data/traffic_network2.csv"
+
+# precompute the flow table used by the table predictor backend
+# run from the repository root: python build_flow_table.py
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--network",
+        default=TRAFFIC_NETWORK_FILE,
+        help="Traffic network csv with the SCATS sites")
+    parser.add_argument(
+        "--output",
+        default=FLOW_TABLE_FILE,
+        help="Flow table .npy file")
+    parser.add_argument(
+        "--reference-date",
+        default="2006-10-02",
+        help="First day of the week the predictions are made for (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    with open(args.network, newline='') as csvfile:
+        sites = [int(row['SCATS Number']) for row in csv.DictReader(csvfile)]
+
+    predictor = TrafficFlowPredictor('keras')
+    build_flow_table(predictor, sites, args.output, datetime.date.fromisoformat(args.reference_date))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import argparse
+import glob
+import os
+from TrafficData.SingleModelScats.data.data import convert_dataset
+
+DATA_FOLDERS = [
+    os.path.join('TrafficData', 'SingleModelScats', 'data'),
+    os.path.join('TrafficData', 'ModelPerScats', 'data', 'locations')
+]
+
+# convert the training and test csvs to the columnar .npz datasets the data loaders read
+# the loaders convert a csv on first use anyway, this does it ahead of time
+# run from the repository root: python convert_datasets.py
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "files",
+        nargs="*",
+        help="csv files to convert, defaults to the train and test csvs of both models")
+    args = parser.parse_args()
+
+    files = args.files or [file for folder in DATA_FOLDERS for file in sorted(glob.glob(os.path.join(folder, '*-*.csv')))]
+    for file in files:
+        convert_dataset(file)
+        print(f"Converted {file}")
+
+if __name__ == "__main__":
+    main()
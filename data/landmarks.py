@@ -0,0 +1,91 @@
+import heapq
+import numpy
+from data.road_network import TrafficGraph, SiteType
+
+# ALT (A*, landmarks and the triangle inequality) preprocessing for the router
+# free flow travel times to and from a few landmark sites give lower bounds on the travel time
+# between any two sites: d(v, t) >= d(L, t) - d(L, v) and d(v, t) >= d(v, L) - d(t, L)
+
+# float32 rounding of the stored times is allowed for so the bounds never overestimate
+ROUNDING_SLACK = 1e-6
+
+# the lowest possible travel time along each edge, driven at the speed limit with the intersection wait at the end
+def get_edge_lower_bounds(traffic_network: TrafficGraph, max_speed: float, wait_time: float) -> numpy.ndarray:
+    waits = numpy.where(traffic_network.site_types[traffic_network.adjacency] == SiteType.INT.value, wait_time, 0.0)
+    return traffic_network.edge_lengths / max_speed + waits
+
+# reverse the csr adjacency so the edges into each node can be walked
+def reverse_edges(traffic_network: TrafficGraph, weights: numpy.ndarray) -> tuple:
+    node_count = len(traffic_network.nodes)
+    sources = numpy.repeat(numpy.arange(node_count), numpy.diff(traffic_network.adjacency_offsets))
+    order = numpy.argsort(traffic_network.adjacency, kind='stable')
+    offsets = numpy.zeros(node_count + 1, dtype=numpy.int64)
+    offsets[1:] = numpy.cumsum(numpy.bincount(traffic_network.adjacency, minlength=node_count))
+    return offsets, sources[order], weights[order]
+
+# dijkstra over static edge weights from the source to every node
+def get_shortest_times(offsets: numpy.ndarray, targets: numpy.ndarray, weights: numpy.ndarray, source: int) -> numpy.ndarray:
+    times = numpy.full(len(offsets) - 1, numpy.inf)
+    times[source] = 0.0
+    frontier = [(0.0, source)]
+    while len(frontier) > 0:
+        time, node = heapq.heappop(frontier)
+        if time > times[node]:
+            continue
+        for i in range(offsets[node], offsets[node + 1]):
+            arrival = time + weights[i]
+            if arrival < times[targets[i]]:
+                times[targets[i]] = arrival
+                heapq.heappush(frontier, (arrival, targets[i]))
+    return times
+
+class Landmarks():
+    def __init__(self, indices: numpy.ndarray, from_landmarks: numpy.ndarray, to_landmarks: numpy.ndarray):
+        # node indices of the landmarks
+        self.indices = indices
+        # [landmark, node] lower bound travel times in hours from each landmark to each node and from each node to each landmark
+        self.from_landmarks = from_landmarks
+        self.to_landmarks = to_landmarks
+
+    def get_lower_bounds(self, target: int) -> numpy.ndarray:
+        # lower bound travel time from every node to the target
+        from_landmarks = self.from_landmarks.astype(numpy.float64)
+        to_landmarks = self.to_landmarks.astype(numpy.float64)
+        with numpy.errstate(invalid='ignore'):
+            forward = from_landmarks[:, [target]] - from_landmarks
+            backward = to_landmarks - to_landmarks[:, [target]]
+            bounds = numpy.fmax(forward, backward).max(axis=0)
+
+        # infinite differences where neither node reaches a landmark carry no information
+        bounds = numpy.nan_to_num(bounds, nan=0.0, posinf=numpy.inf) - ROUNDING_SLACK
+        bounds = numpy.maximum(bounds, 0.0)
+        bounds[target] = 0.0
+        return bounds
+
+# pick landmarks far apart from each other, starting with the site furthest from the first site
+def select_landmarks(offsets: numpy.ndarray, targets: numpy.ndarray, weights: numpy.ndarray, count: int) -> list:
+    node_count = len(offsets) - 1
+    if node_count == 0:
+        return []
+    distances = get_shortest_times(offsets, targets, weights, 0)
+    distances[numpy.isinf(distances)] = -1
+    landmarks = []
+    closest = numpy.full(node_count, numpy.inf)
+    candidate = int(numpy.argmax(distances))
+    while len(landmarks) < min(count, node_count):
+        landmarks.append(candidate)
+        times = get_shortest_times(offsets, targets, weights, candidate)
+        closest = numpy.minimum(closest, numpy.where(numpy.isinf(times), -1, times))
+        closest[landmarks] = -numpy.inf
+        candidate = int(numpy.argmax(closest))
+    return landmarks
+
+def build_landmarks(traffic_network: TrafficGraph, max_speed: float, wait_time: float, count: int = 8) -> Landmarks:
+    weights = get_edge_lower_bounds(traffic_network, max_speed, wait_time)
+    offsets, targets = traffic_network.adjacency_offsets, traffic_network.adjacency
+    reverse_offsets, reverse_targets, reverse_weights = reverse_edges(traffic_network, weights)
+
+    indices = select_landmarks(offsets, targets, weights, count)
+    from_landmarks = numpy.array([get_shortest_times(offsets, targets, weights, i) for i in indices], dtype=numpy.float32)
+    to_landmarks = numpy.array([get_shortest_times(reverse_offsets, reverse_targets, reverse_weights, i) for i in indices], dtype=numpy.float32)
+    return Landmarks(numpy.array(indices, dtype=numpy.int32), from_landmarks, to_landmarks)
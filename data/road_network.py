@@ -0,0 +1,187 @@
+import csv
+import hashlib
+import os
+import string
+import threading
+from enum import Enum
+from pathlib import Path
+import numpy
+import geopy.distance
+
+TRAFFIC_NETWORK_FILE = str(Path(__file__).parent / 'traffic_network2.csv')
+EARTH_RADIUS_KM = 6371.0088 # mean earth radius used for haversine distances
+EARTH_MIN_RADIUS_KM = 6335.439 # smallest radius of curvature of the WGS-84 ellipsoid, haversine distances with it never exceed the geodesic
+
+# enum for each type of scats site
+class SiteType(Enum):
+    INT = 0
+    POS = 1
+    FLASH_PX = 2
+    FIRE_W_W = 3
+    RBT_MTR = 4
+    FIRE_SIG = 5
+    AMBU_SIG = 6
+    RAMP_MTR = 7
+    BUS_SIG = 8
+    TMP_POS = 9
+    O_H_LANE = 10
+
+# the node represents each scats site
+class Node:
+    index: int
+    scats_number: int
+    neighbours: list
+    longitude: float
+    latitude: float
+    name: str
+    scats_type: SiteType 
+
+# great circle distance in km, works on scalars or numpy arrays of coordinates in degrees
+def haversine_km(latitude_1, longitude_1, latitude_2, longitude_2, radius: float = EARTH_RADIUS_KM):
+    lat_1, lon_1, lat_2, lon_2 = map(numpy.radians, (latitude_1, longitude_1, latitude_2, longitude_2))
+    a = numpy.sin((lat_2 - lat_1) / 2) ** 2 + numpy.cos(lat_1) * numpy.cos(lat_2) * numpy.sin((lon_2 - lon_1) / 2) ** 2
+    return 2 * radius * numpy.arcsin(numpy.sqrt(a))
+
+# the traffic graph 
+# nodes are numbered by their position in the nodes list, the neighbours of node i are
+# adjacency[adjacency_offsets[i]:adjacency_offsets[i + 1]] (compressed sparse row layout)
+# and edge_lengths holds the length in km of each of those edges
+class TrafficGraph:
+    nodes: list
+    indices: dict
+    adjacency_offsets: numpy.ndarray
+    adjacency: numpy.ndarray
+    edge_lengths: numpy.ndarray
+    latitudes: numpy.ndarray
+    longitudes: numpy.ndarray
+    site_types: numpy.ndarray
+
+    def __init__(self) -> None:
+        self.nodes = list()
+        self.build_index()
+
+    # distance_mode is 'geodesic' for exact edge lengths or 'haversine' to calculate them all in one vectorized pass
+    def build_index(self, distance_mode: str = 'geodesic') -> None:
+        # map scats numbers to node indices, the first site wins if a number is repeated
+        self.indices = {}
+        for i, node in enumerate(self.nodes):
+            node.index = i
+            self.indices.setdefault(node.scats_number, i)
+
+        # neighbours that aren't sites in the network are dropped
+        offsets = [0]
+        adjacency = list()
+        for node in self.nodes:
+            adjacency.extend(self.indices[n] for n in node.neighbours if n in self.indices)
+            offsets.append(len(adjacency))
+
+        self.adjacency_offsets = numpy.array(offsets, dtype=numpy.int64)
+        self.adjacency = numpy.array(adjacency, dtype=numpy.int32)
+        self.latitudes = numpy.array([node.latitude for node in self.nodes], dtype=numpy.float64)
+        self.longitudes = numpy.array([node.longitude for node in self.nodes], dtype=numpy.float64)
+        self.site_types = numpy.array([node.scats_type.value for node in self.nodes], dtype=numpy.int8)
+
+        # the length of every edge is calculated once here so routing only has to look it up
+        sources = numpy.repeat(numpy.arange(len(self.nodes)), numpy.diff(self.adjacency_offsets))
+        if distance_mode == 'haversine':
+            self.edge_lengths = haversine_km(self.latitudes[sources], self.longitudes[sources], self.latitudes[self.adjacency], self.longitudes[self.adjacency])
+        elif distance_mode == 'geodesic':
+            self.edge_lengths = numpy.array([
+                geopy.distance.geodesic((self.latitudes[u], self.longitudes[u]), (self.latitudes[v], self.longitudes[v])).km
+                for u, v in zip(sources, self.adjacency)
+            ], dtype=numpy.float64)
+        else:
+            raise ValueError(f"Unknown distance mode: {distance_mode}")
+
+    def freeze(self) -> None:
+        # the graph is shared by every request so it is made read only once it is built
+        self.nodes = tuple(self.nodes)
+        for node in self.nodes:
+            node.neighbours = tuple(node.neighbours)
+        for array in (self.adjacency_offsets, self.adjacency, self.edge_lengths, self.latitudes, self.longitudes, self.site_types):
+            array.flags.writeable = False
+
+    def get_index_from_scats_number(self, scats_number: int) -> int:
+        return self.indices.get(scats_number)
+
+    def get_node_from_scats_number(self, scats_number: int) -> Node:
+        i = self.indices.get(scats_number)
+        if i is None:
+            return None
+
+        return self.nodes[i]
+
+    def get_neighbour_indices(self, index: int) -> numpy.ndarray:
+        return self.adjacency[self.adjacency_offsets[index]:self.adjacency_offsets[index + 1]]
+
+    def get_neighbour_nodes(self, node: Node) -> list:
+        return [self.nodes[i] for i in self.get_neighbour_indices(node.index)]
+
+    def get_neighbour_edges(self, node: Node) -> list:
+        # the neighbouring nodes paired with the length of the edge to them
+        start, end = self.adjacency_offsets[node.index], self.adjacency_offsets[node.index + 1]
+        return [(self.nodes[i], float(length)) for i, length in zip(self.adjacency[start:end], self.edge_lengths[start:end])]
+
+    def get_edge_length(self, from_node: Node, to_node: Node) -> float:
+        start, end = self.adjacency_offsets[from_node.index], self.adjacency_offsets[from_node.index + 1]
+        for i in range(start, end):
+            if self.adjacency[i] == to_node.index:
+                return float(self.edge_lengths[i])
+        return None
+
+    def get_straight_line_distances(self, node: Node, radius: float = EARTH_RADIUS_KM) -> numpy.ndarray:
+        # haversine distance from every node to the given node in one vectorized pass
+        return haversine_km(self.latitudes, self.longitudes, node.latitude, node.longitude, radius)
+
+# open the route file 
+def open_road_network(file: string, distance_mode: str = 'geodesic') -> TrafficGraph:
+    tg = TrafficGraph()
+    fieldnames = ['SCATS Number', 'Site Description', 'Site Type', 'Longitude', 'Latitude', 'Neighbours']
+    with open(file, newline='') as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            if len(row['Site Description']) == 0: 
+                continue
+
+            node = Node()
+            node.scats_number = int(row['SCATS Number'])
+            node.name = row['Site Description']
+            node.latitude = float(row['Latitude'])
+            node.longitude = float(row['Longitude'])
+            node.scats_type = SiteType[row['Site Type']]
+            node.neighbours = [int(x) for x in row['Neighbours'].split(';')]
+            tg.nodes.append(node)
+            #print(node.scats_number, node.name, node.latitude, node.longitude, node.scats_type, node.neighbours)
+
+    tg.build_index(distance_mode)
+    tg.freeze()
+    return tg
+
+# process wide registry of loaded road networks so each network file is only parsed once
+# a cached network is reused until the file's modification time or size changes and its contents hash differently
+_networks = {}
+_networks_lock = threading.Lock()
+
+def hash_file(file: string) -> str:
+    with open(file, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def get_traffic_network(file: string = TRAFFIC_NETWORK_FILE, distance_mode: str = 'geodesic') -> TrafficGraph:
+    path = os.path.abspath(file)
+    key = (path, distance_mode)
+    with _networks_lock:
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = _networks.get(key)
+        if cached is not None and cached['signature'] == signature:
+            return cached['network']
+
+        digest = hash_file(path)
+        if cached is None or cached['hash'] != digest:
+            network = open_road_network(path, distance_mode)
+        else:
+            # the file was touched but its contents are the same
+            network = cached['network']
+
+        _networks[key] = {'signature': signature, 'hash': digest, 'network': network}
+        return network
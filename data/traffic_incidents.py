@@ -1,9 +1,9 @@
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 import random
-import csv
 from enum import Enum
 from pathlib import Path
+from data.road_network import get_traffic_network
 
 class IncidentType(Enum):
     ACCIDENT = "Accident"
@@ -26,10 +26,9 @@ class IncidentSimulator:
         self._load_scats_locations(network_file)
 
     def _load_scats_locations(self, network_file: str):
-        with open(network_file, newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                self.scats_locations.append(int(row['SCATS Number']))
+        # the network is shared with the router through the network registry
+        traffic_network = get_traffic_network(network_file)
+        self.scats_locations = [node.scats_number for node in traffic_network.nodes]
 
     def generate_random_incident(self, current_time: datetime) -> TrafficIncident:
         incident_type = random.choice(list(IncidentType))
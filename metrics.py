@@ -0,0 +1,151 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# lightweight in-process counters and latency histograms rendered in the prometheus text format
+# every metric is registered in REGISTRY which the apps serve from /metrics
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# latency buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def format_labels(label_names: tuple, label_values: tuple, extra: str = '') -> str:
+    labels = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if len(labels) > 0 else ''
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+class Counter():
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def samples(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{format_labels(self.label_names, key)} {format_value(value)}' for key, value in values]
+
+class Histogram():
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        # observe the time taken by the with block in seconds
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_count(self, **labels) -> int:
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            counts, _ = self._values.get(key, ([0], 0.0))
+            return sum(counts)
+
+    def samples(self) -> list:
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="' + format_value(bound) + '"'
+                lines.append(f'{self.name}_bucket{format_labels(self.label_names, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.label_names, key)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(self.label_names, key)} {cumulative}')
+        return lines
+
+class MetricsRegistry():
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # modules may be reloaded, keep the metric that was registered first
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = MetricsRegistry()
+
+def counter(name: str, documentation: str, label_names: tuple = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, label_names))
+
+def histogram(name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, label_names, buckets))
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+# routing
+ROUTE_LABELS_EXPANDED = counter('route_labels_expanded_total', 'Route nodes expanded by the route search')
+ROUTER_SECONDS = histogram('router_request_seconds', 'End to end latency of runRouter')
+
+# prediction
+PREDICTIONS_ISSUED = counter('predictions_issued_total', 'Flow predictions made by the traffic flow predictor', ('model',))
+PREDICT_TRAFFIC_FLOW_SECONDS = histogram('predict_traffic_flow_seconds', 'Latency of TrafficFlowPredictor.predict_traffic_flow', ('model',))
+PREDICT_TRAFFIC_FLOWS_SECONDS = histogram('predict_traffic_flows_seconds', 'Latency of a batched TrafficFlowPredictor.predict_traffic_flows call', ('model',))
+MODEL_INFERENCE_SECONDS = histogram('model_inference_seconds', 'Latency of a single model inference call', ('model',))
+MODEL_LOAD_SECONDS = histogram('model_load_seconds', 'Time taken to load a model file', ('model',))
+
+# inference queues
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+INFERENCE_BATCH_SIZE = histogram('inference_batch_size', 'Samples in each batch run by an inference queue', ('model',), BATCH_SIZE_BUCKETS)
+INFERENCE_BATCH_REQUESTS = histogram('inference_batch_requests', 'Requests merged into each batch run by an inference queue', ('model',), BATCH_SIZE_BUCKETS)
+
+# prediction cache
+PREDICTION_CACHE_HITS = counter('prediction_cache_hits_total', 'Flow predictions answered by a prediction cache')
+PREDICTION_CACHE_MISSES = counter('prediction_cache_misses_total', 'Flow predictions missing from a prediction cache')
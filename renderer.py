@@ -6,6 +6,7 @@ import json
 import csv
 import os
 import datetime
+from data.road_network import get_traffic_network
 
 TRAFFIC_NETWORK = 'data/traffic_network2.csv'
 
@@ -15,11 +16,9 @@ style = lambda x: {
 }
 
 def getCoords(scat):
-    file = open(TRAFFIC_NETWORK, 'r')
-
-    for row in csv.reader(file):
-        if row[0] == str(scat):
-            return float(row[4]) + 0.0012469, float(row[3]) + 0.0012275
+    node = get_traffic_network(TRAFFIC_NETWORK).get_node_from_scats_number(int(scat))
+    if node is not None:
+        return node.longitude + 0.0012469, node.latitude + 0.0012275
 
     print("unable to find SCAT location")
     return 0,0
@@ -62,16 +61,12 @@ def drawMarkers(map, src, dest):
     folium.Marker([dest_lat, dest_lon], popup=f"<strong>Finish</strong> SCATS: {dest}", icon=folium.Icon(color='red', icon='flag', prefix='fa')).add_to(map)
 
 def drawNodes(map):
-    file = open(TRAFFIC_NETWORK, 'r')
-
-    for iter, row in enumerate(csv.reader(file)):
-        if iter == 0:
-            continue
-        lon, lat = getCoords(row[0])
+    for node in get_traffic_network(TRAFFIC_NETWORK).nodes:
+        lon, lat = getCoords(node.scats_number)
         folium.Circle(
             radius=5,
             location=[lat, lon],
-            popup=f"SCATS: {row[0]}",
+            popup=f"SCATS: {node.scats_number}",
             color="#5A5A5A",
             fill=False,
             ).add_to(map)
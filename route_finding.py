@@ -1,14 +1,22 @@
-from cmath import sqrt
 from distutils.log import debug
 import string
 import csv
 import datetime
-from data.traffic_incidents import IncidentSimulator, TrafficIncident, IncidentType
+from data.traffic_incidents import IncidentSimulator, TrafficIncident, IncidentType, incident_simulator
+from data.road_network import SiteType, Node, TrafficGraph, haversine_km, open_road_network, get_traffic_network, EARTH_RADIUS_KM, EARTH_MIN_RADIUS_KM
+from data.landmarks import Landmarks, build_landmarks
 import numpy
 import random
 from sys import float_repr_style
 import geopy.distance
-from TrafficData.TrafficFlowPredictor import TrafficFlowPredictor,TrafficFlowModelsEnum
+import heapq
+import itertools
+import logging
+import threading
+import weakref
+from TrafficData.TrafficFlowPredictor import TrafficFlowPredictor,TrafficFlowModelsEnum,get_predictor
+from TrafficData.PredictionCache import PredictionCache
+from metrics import ROUTE_LABELS_EXPANDED, ROUTER_SECONDS
 from enum import Enum
 from operator import attrgetter
 from typing import List
@@ -25,9 +33,14 @@ A = -MAX_FLOW_RATE / (CAPACITY_SPEED * CAPACITY_SPEED)
 B = -2 * CAPACITY_SPEED * A
 ITERSECTION_WAIT_TIME = 30 / 60 / 60 # approximate an average wait time of 30 seconds for each intersection this is converted to hours
 TRAFFIC_NETWORK_FILE = "data/traffic_network2.csv"
+PREDICTION_STEPS = 4 # number of 15 minute intervals summed for each flow prediction
+PREDICTION_BATCH_SIZE = 16 # number of frontier nodes whose flow predictions are made in one batched model call
+LANDMARK_COUNT = 8 # number of landmarks used for the ALT heuristic
 
-predictor = TrafficFlowPredictor()
-incident_simulator = IncidentSimulator(TRAFFIC_NETWORK_FILE)
+logger = logging.getLogger(__name__)
+
+# the process wide predictor, shared with the apps
+predictor = get_predictor()
 
 # Define timesteps and features
 timesteps = 10  # Example value, set this to the number of timesteps in your input data
@@ -39,75 +52,35 @@ model.add(LSTM(50, return_sequences=False))  # Ensure no unsupported arguments
 model.add(Dense(1))
 model.compile(optimizer='adam', loss='mse')
 
-# enum for each type of scats site
-class SiteType(Enum):
-    INT = 0
-    POS = 1
-    FLASH_PX = 2
-    FIRE_W_W = 3
-    RBT_MTR = 4
-    FIRE_SIG = 5
-    AMBU_SIG = 6
-    RAMP_MTR = 7
-    BUS_SIG = 8
-    TMP_POS = 9
-    O_H_LANE = 10
-
-# the node represents each scats site
-class Node:
-    scats_number: int
-    neighbours: list
-    longitude: float
-    latitude: float
-    name: str
-    scats_type: SiteType 
-
-# the traffic graph 
-class TrafficGraph:
-    nodes: list
-
-    def __init__(self) -> None:
-        self.nodes = list()
-
-    def get_node_from_scats_number(self, scats_number: int) -> Node:
-        n = [x for x in self.nodes if x.scats_number == scats_number]
-        if len(n) == 0:
-            return None
-
-        return n[0]
-
-
 # the route
 class Route:
     nodes: list
     cost: float
+    distance: float
 
-    def __init__(self, cost) -> None:
+    def __init__(self, cost, distance: float = 0.0) -> None:
         self.nodes = list()
         self.cost = cost
+        self.distance = distance
 
     def print_route(self):
         directions = ""
         for node in self.nodes:
-            print(node.scats_number ,"-" ,node.name)
+            logger.info("%s - %s", node.scats_number, node.name)
             directions += f"{node.scats_number} - {node.name}\n"
-        print ("Length:\t\t", len(self.nodes))
+        logger.info("Length:\t\t %s", len(self.nodes))
         directions += "Length:\t\t" + str(len(self.nodes)) + "\n"
-        print ("Distance:\t", "{:.2f}".format(self.calculate_route_distance()) + "km")
-        directions += "Distance:\t\t" + "{:.2f}".format(self.calculate_route_distance()) + "km\n"
+        distance = self.calculate_route_distance()
+        logger.info("Distance:\t %.2fkm", distance)
+        directions += "Distance:\t\t" + "{:.2f}".format(distance) + "km\n"
         # convert cost from seconds to minutes
-        print ("Cost:\t\t", "{:.2f}".format(self.cost * 60) + "mins")
+        logger.info("Cost:\t\t %.2fmins", self.cost * 60)
         directions += "Cost:\t\t" + "{:.2f}".format(self.cost * 60) + "mins\n\n"
         return directions
 
     def calculate_route_distance(self) -> float:
-        dist = 0.0
-        for i in range(len(self.nodes) - 1):
-            coords_1 = (self.nodes[i].latitude, self.nodes[i].longitude)
-            coords_2 = (self.nodes[i + 1].latitude, self.nodes[i + 1].longitude)
-
-            dist += geopy.distance.geodesic(coords_1, coords_2).km
-        return dist
+        # the distance is summed from the stored edge lengths when the route is built
+        return self.distance
 
     def list_scats(self):
         arr = list()
@@ -120,14 +93,20 @@ class RouteNode:
     node: Node
     previous_node: 'RouteNode'
     cost: float
+    distance: float
     date: datetime
     model_type: string
+    prediction_cache: PredictionCache
 
-    def __init__(self, node: Node, previous_node: 'RouteNode', date: datetime, model_type: string) -> None:
+    # distance is the length of the edge from the previous node in km
+    # the prediction cache is shared by every route node in a search
+    def __init__(self, node: Node, previous_node: 'RouteNode', date: datetime, model_type: string, distance: float = 0.0, prediction_cache: PredictionCache = None) -> None:
         self.node = node
         self.previous_node = previous_node
+        self.distance = distance
         self.date = date
         self.model_type = model_type
+        self.prediction_cache = prediction_cache
         self.cost = self.calcuate_node_cost(date, model_type)
         #print(self.node.name, self.cost)
 
@@ -137,30 +116,39 @@ class RouteNode:
         while cur_node != None:
             #print (cur_node.node.scats_number)
             route.nodes.append(cur_node.node)
+            route.distance += cur_node.distance
             cur_node = cur_node.previous_node
         route.nodes.reverse()
         #print(len(route.nodes))
         #print(self.cost, "km")
         return route
+
+    def get_path(self) -> list:
+        # the route nodes from the origin up to and including this node
+        path = list()
+        cur_node: 'RouteNode' = self
+        while cur_node != None:
+            path.append(cur_node)
+            cur_node = cur_node.previous_node
+        path.reverse()
+        return path
     
     def expand_nodes(self, traffic_network: TrafficGraph) -> list:
-        nodes = list()
-        for n in self.node.neighbours:
-            nodes.append(traffic_network.get_node_from_scats_number(n))
-        return nodes
+        # the neighbouring nodes paired with the length of the edge to them
+        return traffic_network.get_neighbour_edges(self.node)
+
+    def get_departure_time(self) -> datetime:
+        return self.date + datetime.timedelta(hours=self.cost)
 
-    def expand_node(self, node: Node):
-        return RouteNode(node, self, self.date, self.model_type)
+    def expand_node(self, node: Node, distance: float):
+        return RouteNode(node, self, self.date, self.model_type, distance, self.prediction_cache)
 
     def calcuate_node_cost(self, date: datetime, model_type: string) -> float:
         if self.previous_node == None:
             return 0.0
         
-        # caclucate the cost to travel to the previous node
-        coords_1 = (self.node.latitude, self.node.longitude)
-        coords_2 = (self.previous_node.node.latitude, self.previous_node.node.longitude)
-
-        dist = geopy.distance.geodesic(coords_1, coords_2).km
+        # the cost to travel from the previous node uses the precomputed edge length
+        dist = self.distance
 
         # check the locations are correct
         if dist == 0:
@@ -169,115 +157,253 @@ class RouteNode:
         # calculate the speed of the segment
         # flow the number of vehicles passing over a point over a period of time
         # add the cost to the predition so the traffic times are slightly more accurate
-        new_date_time = date + datetime.timedelta(hours=self.previous_node.cost)
-        print("model type here: " + model_type)
-        # Get base flow prediction
-        base_flow = predictor.predict_traffic_flow(self.previous_node.node.scats_number, new_date_time, 4, model_type)
-        
-        # Apply incident effects
-        flow_multiplier = incident_simulator.get_flow_multiplier(self.previous_node.node.scats_number, new_date_time)
-        flow = base_flow * flow_multiplier
+        new_date_time = self.previous_node.get_departure_time()
+        logger.debug("model type: %s", model_type)
+        flow = get_departure_flow(self.previous_node.node.scats_number, new_date_time, model_type, self.prediction_cache)
         #random.seed(self.previous_node.node.scats_number + time.minute)
         #flow = random.randint(0, 1800)
 
-        speed = convert_flow_to_speed(flow)
-        
-        # calculate segment time in seconds
-        segment_time = dist / speed
-
         # add the cost to the current cost of the path
-        cost = self.previous_node.cost + segment_time + ITERSECTION_WAIT_TIME if self.node.scats_type == SiteType.INT else 0
+        cost = self.previous_node.cost + calculate_segment_time(dist, flow, self.node.scats_type)
 
         return cost
 
-def convert_flow_to_speed(flow: float, over_capacity: bool = False) -> float:
-    # clamp the flow value to the flow capacity
-    clamped_flow = numpy.clip(flow, 0, MAX_FLOW_RATE)
-    
+# the flow leaving a site at the given time, predicted by the model with the incident effects applied
+def get_departure_flow(scats_number: int, date: datetime, model_type: string, prediction_cache: PredictionCache = None) -> float:
+    # Get base flow prediction
+    if prediction_cache is not None:
+        base_flow = prediction_cache.predict_traffic_flow(predictor, scats_number, date, PREDICTION_STEPS, model_type)
+    else:
+        base_flow = predictor.predict_traffic_flow(scats_number, date, PREDICTION_STEPS, model_type)
+
+    # Apply incident effects
+    return base_flow * incident_simulator.get_flow_multiplier(scats_number, date)
+
+# the time in hours to drive a segment at the speed for the flow, plus the wait when it ends at an intersection
+def calculate_segment_time(distance: float, flow: float, site_type: SiteType) -> float:
+    speed = convert_flow_to_speed(flow)
+    return distance / speed + (ITERSECTION_WAIT_TIME if site_type == SiteType.INT else 0)
+
+# convert traffic flows (veh/hr) to speeds (km/hr) with the quadratic speed-flow relationship
+# works on scalars or numpy arrays, over_capacity selects the congested branch of the quadratic
+def convert_flows_to_speeds(flows, over_capacity: bool = False) -> numpy.ndarray:
+    # clamp the flow values to the flow capacity
+    clamped_flows = numpy.clip(numpy.asarray(flows, dtype=numpy.float64), 0, MAX_FLOW_RATE)
+
+    # the discriminant is 0 at capacity, don't let rounding push it below
+    root = numpy.sqrt(numpy.maximum(B*B+4*A*clamped_flows, 0.0))
     if over_capacity:
-        traffic_speed = (-B + sqrt(B*B+4*A*clamped_flow)) / (2 * A)
+        traffic_speeds = (-B + root) / (2 * A)
     else:
-        traffic_speed = (-B - sqrt(B*B+4*A*clamped_flow)) / (2 * A)
-    print("flow:", flow, "speed:", traffic_speed.real)
+        traffic_speeds = (-B - root) / (2 * A)
 
     # select the min speed as traffic can't breach the speed limit
-    return min(MAX_SPEED, traffic_speed.real)
-
-# open the route file 
-def open_road_network(file: string) -> TrafficGraph:
-    tg = TrafficGraph()
-    fieldnames = ['SCATS Number', 'Site Description', 'Site Type', 'Longitude', 'Latitude', 'Neighbours']
-    with open(file, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            if len(row['Site Description']) == 0: 
-                continue
+    return numpy.minimum(MAX_SPEED, traffic_speeds)
 
-            node = Node()
-            node.scats_number = int(row['SCATS Number'])
-            node.name = row['Site Description']
-            node.latitude = float(row['Latitude'])
-            node.longitude = float(row['Longitude'])
-            node.scats_type = SiteType[row['Site Type']]
-            node.neighbours = [int(x) for x in row['Neighbours'].split(';')]
-            tg.nodes.append(node)
-            #print(node.scats_number, node.name, node.latitude, node.longitude, node.scats_type, node.neighbours)
+# speeds for every integer flow from 0 to MAX_FLOW_RATE for each branch of the quadratic
+SPEED_LOOKUP_TABLE = convert_flows_to_speeds(numpy.arange(MAX_FLOW_RATE + 1))
+OVER_CAPACITY_SPEED_LOOKUP_TABLE = convert_flows_to_speeds(numpy.arange(MAX_FLOW_RATE + 1), over_capacity=True)
 
-    return tg
+# approximate the speeds by looking up the flows rounded to the nearest integer, for bulk conversions
+def lookup_speeds(flows, over_capacity: bool = False) -> numpy.ndarray:
+    table = OVER_CAPACITY_SPEED_LOOKUP_TABLE if over_capacity else SPEED_LOOKUP_TABLE
+    indices = numpy.clip(numpy.rint(numpy.asarray(flows, dtype=numpy.float64)), 0, MAX_FLOW_RATE).astype(numpy.int64)
+    return table[indices]
+
+def convert_flow_to_speed(flow: float, over_capacity: bool = False) -> float:
+    return float(convert_flows_to_speeds(flow, over_capacity))
+
+# the landmarks are built once for each traffic graph and kept for as long as the graph is
+_landmarks = weakref.WeakKeyDictionary()
+_landmarks_lock = threading.Lock()
+
+def get_landmarks(traffic_network: TrafficGraph) -> Landmarks:
+    with _landmarks_lock:
+        landmarks = _landmarks.get(traffic_network)
+        if landmarks is None:
+            landmarks = build_landmarks(traffic_network, MAX_SPEED, ITERSECTION_WAIT_TIME, LANDMARK_COUNT)
+            _landmarks[traffic_network] = landmarks
+        return landmarks
+
+# admissible estimate of the remaining travel time from each node to the destination
+# no segment can be driven faster than the speed limit and entering an intersection always costs the wait time
+# the estimate is the better of the straight line time and the landmark (ALT) lower bounds
+def create_heuristic(traffic_network: TrafficGraph, destination_node: Node):
+    # the straight line distances to the destination are calculated for every node at once
+    distances = traffic_network.get_straight_line_distances(destination_node, EARTH_MIN_RADIUS_KM)
+    wait = ITERSECTION_WAIT_TIME if destination_node.scats_type == SiteType.INT else 0
+    estimates = numpy.maximum(distances / MAX_SPEED + wait, get_landmarks(traffic_network).get_lower_bounds(destination_node.index))
+    estimates[destination_node.index] = 0.0
+
+    def heuristic(node: Node) -> float:
+        return estimates[node.index]
+    return heuristic
+
+# predict the flows the route nodes will be expanded with in one batched model call
+# the predictions are stored in the route nodes' prediction cache so expanding them doesn't call the model again
+# nodes without data are left out of the cache, they only fail the search if it goes on to expand them
+def prefetch_predictions(route_nodes: list) -> None:
+    prediction_cache: PredictionCache = route_nodes[0].prediction_cache
+    requests = [(route_node.node.scats_number, route_node.get_departure_time()) for route_node in route_nodes]
+    prediction_cache.predict_traffic_flows(predictor, requests, PREDICTION_STEPS, route_nodes[0].model_type)
 
 # a-star algorithm 
-def find_routes(traffic_network: TrafficGraph, origin: int, destination: int, date: datetime, model_type: string, route_options_count: int = 5) -> list:
-    routes = list()
-    destination_node = traffic_network.get_node_from_scats_number(destination)
+# searches from the start route node and returns the route node at the destination, or None if it can't be reached
+# blocked edges (from, to) can't be travelled along
+def find_shortest_route(traffic_network: TrafficGraph, start: RouteNode, destination_node: Node, heuristic, blocked_edges: set = frozenset()) -> RouteNode:
+    # the frontier is a binary heap ordered by the estimated total cost
+    # the counter breaks ties in insertion order so route nodes are never compared
     frontier = list()
-    # add origin to frontier
-    frontier.append(RouteNode(traffic_network.get_node_from_scats_number(origin), None, date, model_type))
-    while len(frontier) > 0:
-        # sort the frontier by the path cost
-        frontier.sort(key=lambda x: x.cost)
+    counter = itertools.count()
+    heapq.heappush(frontier, (start.cost + heuristic(start.node), next(counter), start))
+
+    # nodes already in the path to the start can't be visited again
+    closed = set(route_node.node.scats_number for route_node in start.get_path()[:-1])
 
-        # selected is the fist node in the list as it has the lowest cost
-        selected: RouteNode = frontier[0]
+    while len(frontier) > 0:
+        # selected is the node with the lowest estimated total cost
+        selected: RouteNode = heapq.heappop(frontier)[2]
+        if selected.node.scats_number in closed:
+            continue
 
         # is the frontier at the destination?
         if selected.node == destination_node:
-            #print ("route found")
-            routes.append(selected.convert_to_route())
-            
-            # remove destination node from list
-            frontier.remove(selected)
-            
-            # exit search when the desired number of routes are found 
-            if len(routes) == route_options_count:
-                break
+            return selected
+
+        closed.add(selected.node.scats_number)
+        ROUTE_LABELS_EXPANDED.inc()
+
+        # the children of the selected node are costed with the flow at the selected node, if it isn't cached
+        # predict it together with the flows of the next nodes in the frontier which will likely be expanded soon
+        cache = selected.prediction_cache
+        if cache is not None and cache.get_key(selected.node.scats_number, selected.get_departure_time(), PREDICTION_STEPS, selected.model_type) not in cache:
+            upcoming = [entry[2] for entry in heapq.nsmallest(PREDICTION_BATCH_SIZE - 1, frontier)]
+            prefetch_predictions([selected] + [n for n in upcoming if n.node.scats_number not in closed and n.node != destination_node])
 
-            continue
-        
         # expand the selected node
-        children: list = selected.expand_nodes(traffic_network)
-        
-        # remove the selected node from the frontier
-        frontier.remove(selected)
-
-        # remove nodes with loops in it
-        for c in children:
-            new_node: Node = c
-            previous_node: RouteNode = selected.previous_node
-            duplicated = False
-            while previous_node != None:
-                if new_node == previous_node.node:
-                    # duplicated node
-                    print("duplicated")
-                    duplicated = True
-                    break
-                # set the previous node to the previous previous node
-                previous_node = previous_node.previous_node
-            
-            if not duplicated:
-                frontier.append(selected.expand_node(c))
+        for c, distance in selected.expand_nodes(traffic_network):
+            if c.scats_number in closed or (selected.node.scats_number, c.scats_number) in blocked_edges:
+                continue
+            child = selected.expand_node(c, distance)
+            heapq.heappush(frontier, (child.cost + heuristic(child.node), next(counter), child))
 
-    
-    return routes
+    return None
+
+# time dependent dijkstra from the origin to every node with the same cost model as the route search
+# returns the travel time in hours to each node of the traffic graph, inf where the node can't be reached
+# if a budget (hours) is given the search stops expanding at it and nodes beyond it are left at inf
+def find_travel_times(traffic_network: TrafficGraph, origin: int, date: datetime, model_type: string, prediction_cache: PredictionCache = None, budget: float = None) -> numpy.ndarray:
+    if prediction_cache is None:
+        prediction_cache = PredictionCache()
+
+    nodes = traffic_network.nodes
+    times = numpy.full(len(nodes), numpy.inf)
+    settled = numpy.zeros(len(nodes), dtype=bool)
+    origin_index = traffic_network.get_index_from_scats_number(origin)
+    times[origin_index] = 0.0
+    frontier = [(0.0, origin_index)]
+
+    while len(frontier) > 0:
+        time, index = heapq.heappop(frontier)
+        if settled[index]:
+            continue
+        settled[index] = True
+        ROUTE_LABELS_EXPANDED.inc()
+
+        # predict the flow here together with the flows of the next nodes in the frontier
+        node: Node = nodes[index]
+        departure = date + datetime.timedelta(hours=time)
+        if prediction_cache.get_key(node.scats_number, departure, PREDICTION_STEPS, model_type) not in prediction_cache:
+            upcoming = [entry for entry in heapq.nsmallest(PREDICTION_BATCH_SIZE - 1, frontier) if not settled[entry[1]]]
+            requests = [(node.scats_number, departure)] + [(nodes[i].scats_number, date + datetime.timedelta(hours=t)) for t, i in upcoming]
+            prediction_cache.predict_traffic_flows(predictor, requests, PREDICTION_STEPS, model_type)
+        flow = get_departure_flow(node.scats_number, departure, model_type, prediction_cache)
+
+        for neighbour, distance in traffic_network.get_neighbour_edges(node):
+            if settled[neighbour.index]:
+                continue
+            arrival = time + calculate_segment_time(distance, flow, neighbour.scats_type)
+            if budget is not None and arrival > budget:
+                continue
+            if arrival < times[neighbour.index]:
+                times[neighbour.index] = arrival
+                heapq.heappush(frontier, (arrival, neighbour.index))
+
+    return times
+
+# yen's k shortest loopless paths
+# each alternative route is found by a spur search that leaves an earlier route at one of its nodes,
+# the spur search starts from the earlier route's node so the arrival times along the shared root are kept
+# predictions are cached for the search, pass a prediction cache to share them across searches
+def find_routes(traffic_network: TrafficGraph, origin: int, destination: int, date: datetime, model_type: string, route_options_count: int = 5, prediction_cache: PredictionCache = None) -> list:
+    destination_node = traffic_network.get_node_from_scats_number(destination)
+    heuristic = create_heuristic(traffic_network, destination_node)
+
+    if prediction_cache is None:
+        prediction_cache = PredictionCache()
+
+    origin_node = RouteNode(traffic_network.get_node_from_scats_number(origin), None, date, model_type, prediction_cache=prediction_cache)
+    shortest = find_shortest_route(traffic_network, origin_node, destination_node, heuristic)
+    if shortest is None:
+        return list()
+
+    # the paths of the routes found so far
+    paths = [shortest.get_path()]
+    seen = {tuple(route_node.node.scats_number for route_node in paths[0])}
+
+    # candidate routes are kept in a binary heap ordered by cost
+    candidates = list()
+    counter = itertools.count()
+
+    while len(paths) < route_options_count:
+        last_path = paths[-1]
+        for i in range(len(last_path) - 1):
+            spur_node: RouteNode = last_path[i]
+            root = [route_node.node.scats_number for route_node in last_path[:i + 1]]
+
+            # block the next edge of every route that shares the same root so a new route is found
+            blocked_edges = set()
+            for path in paths:
+                if len(path) > i + 1 and [route_node.node.scats_number for route_node in path[:i + 1]] == root:
+                    blocked_edges.add((path[i].node.scats_number, path[i + 1].node.scats_number))
+
+            spur = find_shortest_route(traffic_network, spur_node, destination_node, heuristic, blocked_edges=blocked_edges)
+            if spur is None:
+                continue
+
+            path = spur.get_path()
+            key = tuple(route_node.node.scats_number for route_node in path)
+            if key in seen:
+                continue
+            seen.add(key)
+            heapq.heappush(candidates, (spur.cost, next(counter), path))
+
+        if len(candidates) == 0:
+            break
+
+        paths.append(heapq.heappop(candidates)[2])
+
+    return [path[-1].convert_to_route() for path in paths]
+
+# travel times in hours along each route for every departure time, as a [route, departure] array
+# the routes are walked one edge at a time with every departure advanced together, the flows for each edge
+# are predicted in one batched call through the prediction cache so departures in the same interval share them
+def retime_routes(traffic_network: TrafficGraph, routes: list, departures: list, model_type: string, prediction_cache: PredictionCache = None) -> numpy.ndarray:
+    if prediction_cache is None:
+        prediction_cache = PredictionCache()
+
+    times = numpy.zeros((len(routes), len(departures)))
+    for r, route in enumerate(routes):
+        for from_node, to_node in zip(route.nodes, route.nodes[1:]):
+            distance = traffic_network.get_edge_length(from_node, to_node)
+            leaving = [departure + datetime.timedelta(hours=time) for departure, time in zip(departures, times[r])]
+            flows = numpy.array(prediction_cache.predict_traffic_flows(predictor, [(from_node.scats_number, date) for date in leaving], PREDICTION_STEPS, model_type))
+            if numpy.isnan(flows).any():
+                raise Exception(f"No Data exists for location {from_node.scats_number}")
+            flows *= numpy.array([incident_simulator.get_flow_multiplier(from_node.scats_number, date) for date in leaving])
+            times[r] += distance / convert_flows_to_speeds(flows) + (ITERSECTION_WAIT_TIME if to_node.scats_type == SiteType.INT else 0)
+
+    return times
 
 # display the routes 
 
@@ -303,12 +429,13 @@ def createParser():
     args = parser.parse_args()
     return args
 
+@ROUTER_SECONDS.time()
 def runRouter(src, dest, date, model: string, add_random_incidents: bool = True):
     model_type = model
     directions = ""
     scatsList = []
-    traffic_network = open_road_network(TRAFFIC_NETWORK_FILE)
-    print(traffic_network.get_node_from_scats_number(int(src)))
+    traffic_network = get_traffic_network(TRAFFIC_NETWORK_FILE)
+    logger.debug("source node: %s", traffic_network.get_node_from_scats_number(int(src)))
 
     # Generate random incidents if requested
     if add_random_incidents:
@@ -328,7 +455,7 @@ def runRouter(src, dest, date, model: string, add_random_incidents: bool = True)
     except Exception as e:
         return f"Error finding routes: {str(e)}"
     for i, r in enumerate(routes):
-        print (f"--ROUTE {i + 1}--")
+        logger.info("--ROUTE %d--", i + 1)
         directions += f"--ROUTE {i + 1}--\n"
         directions += r.print_route()
         scatsList.append(r.list_scats())
@@ -337,5 +464,6 @@ def runRouter(src, dest, date, model: string, add_random_incidents: bool = True)
     return directions
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     args = createParser()
     runRouter(args.src, args.dest, datetime.datetime.now(), TrafficFlowModelsEnum.LSTM.value)
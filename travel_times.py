@@ -0,0 +1,171 @@
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import datetime
+import multiprocessing
+import os
+import string
+import threading
+import numpy
+import route_finding as router
+from data.road_network import get_traffic_network
+from data.traffic_incidents import incident_simulator
+from TrafficData.PredictionCache import PredictionCache
+
+ROUTE_BATCH_WORKERS = 8 # most route searches run at once by find_routes_batch
+MAX_SWEEP_WINDOW = datetime.timedelta(days=1) # longest departure window sweep_departure_times accepts
+MAX_SWEEP_DEPARTURES = 288 # most departures in one sweep, a day every 5 minutes
+MATRIX_PROCESSES = int(os.environ.get('TRAFFIC_MATRIX_PROCESSES', 4)) # worker processes the matrix origins are spread over, 1 searches in process
+
+# prediction cache shared by every origin a worker process searches from
+_worker_prediction_cache: PredictionCache = None
+
+def _init_worker():
+    global _worker_prediction_cache
+    _worker_prediction_cache = PredictionCache()
+
+def _find_travel_times(args) -> numpy.ndarray:
+    network_file, origin, date, model_type, incidents = args
+    # a worker runs one search at a time so it can take on the incidents active in the parent for each search
+    incident_simulator.active_incidents = list(incidents)
+    traffic_network = get_traffic_network(network_file)
+    return router.find_travel_times(traffic_network, origin, date, model_type, _worker_prediction_cache)
+
+# the worker pools are started once and kept for every matrix, starting a worker imports the router,
+# tensorflow and the predictor so it is far too slow to do for each request
+_matrix_pools = {}
+_matrix_pools_lock = threading.Lock()
+
+def get_matrix_pool(processes: int) -> concurrent.futures.ProcessPoolExecutor:
+    with _matrix_pools_lock:
+        pool = _matrix_pools.get(processes)
+        if pool is None:
+            # workers are spawned rather than forked so they don't inherit the parent's tensorflow state
+            context = multiprocessing.get_context('spawn')
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker)
+            _matrix_pools[processes] = pool
+        return pool
+
+def _drop_matrix_pool(processes: int, pool: concurrent.futures.ProcessPoolExecutor) -> None:
+    # a pool with a dead worker can't run any more jobs, the next matrix starts a new one
+    with _matrix_pools_lock:
+        if _matrix_pools.get(processes) is pool:
+            del _matrix_pools[processes]
+    pool.shutdown(wait=False)
+
+# origin-destination travel time matrix with one time dependent dijkstra search per origin
+# returns the origin scats numbers, the destination scats numbers (every site in the network) and a
+# [origin, destination] matrix of travel times in hours, inf where the destination can't be reached
+# the origins are spread over a shared pool of processes, processes=1 searches in this process instead
+# both apply the incidents active in this process so the matrix doesn't depend on how it was searched
+def calculate_travel_time_matrix(date: datetime.datetime, model_type: string, origins: list = None, network_file: string = router.TRAFFIC_NETWORK_FILE, processes: int = MATRIX_PROCESSES, prediction_cache: PredictionCache = None) -> tuple:
+    network_file = os.path.abspath(network_file)
+    traffic_network = get_traffic_network(network_file)
+    sites = [node.scats_number for node in traffic_network.nodes]
+
+    origins = sites if origins is None else [int(origin) for origin in origins]
+    for origin in origins:
+        if traffic_network.get_node_from_scats_number(origin) is None:
+            raise ValueError(f"Invalid origin SCATS Number: {origin}")
+
+    matrix = numpy.full((len(origins), len(sites)), numpy.inf)
+    processes = max(processes or MATRIX_PROCESSES, 1)
+    if processes == 1 or len(origins) <= 1:
+        if prediction_cache is None:
+            prediction_cache = PredictionCache()
+        for i, origin in enumerate(origins):
+            matrix[i] = router.find_travel_times(traffic_network, origin, date, model_type, prediction_cache)
+        return origins, sites, matrix
+
+    incidents = list(incident_simulator.active_incidents)
+    jobs = [(network_file, origin, date, model_type, incidents) for origin in origins]
+    pool = get_matrix_pool(processes)
+    try:
+        for i, times in enumerate(pool.map(_find_travel_times, jobs)):
+            matrix[i] = times
+    except BrokenProcessPool:
+        _drop_matrix_pool(processes, pool)
+        raise
+
+    return origins, sites, matrix
+
+# every site reachable from the origin within the budget (minutes) with its travel time in hours
+# a single time dependent dijkstra search that stops expanding once the budget is used up
+# returns a list of (scats number, travel time) sorted by travel time, starting with the origin
+def calculate_isochrone(origin: int, date: datetime.datetime, model_type: string, budget: float, network_file: string = router.TRAFFIC_NETWORK_FILE, prediction_cache: PredictionCache = None) -> list:
+    traffic_network = get_traffic_network(network_file)
+    if traffic_network.get_node_from_scats_number(int(origin)) is None:
+        raise ValueError(f"Invalid origin SCATS Number: {origin}")
+    if budget < 0:
+        raise ValueError(f"Invalid time budget: {budget}")
+
+    times = router.find_travel_times(traffic_network, int(origin), date, model_type, prediction_cache, budget / 60)
+    reachable = numpy.flatnonzero(numpy.isfinite(times))
+    reachable = reachable[numpy.argsort(times[reachable], kind='stable')]
+    return [(traffic_network.nodes[i].scats_number, float(times[i])) for i in reachable]
+
+# travel time between two sites for every departure in a window, from start to end every interval minutes
+# the candidate routes are found once at the start, middle and end of the window and every route is re-timed
+# for every departure, the predictions are shared across all of them through one prediction cache
+# returns the candidate routes, the departures and a [route, departure] array of travel times in hours
+# windows longer than MAX_SWEEP_WINDOW or with more than MAX_SWEEP_DEPARTURES departures are refused
+def sweep_departure_times(origin: int, destination: int, start: datetime.datetime, end: datetime.datetime, model_type: string, interval: int = 5, route_options_count: int = 5, network_file: string = router.TRAFFIC_NETWORK_FILE, prediction_cache: PredictionCache = None) -> tuple:
+    traffic_network = get_traffic_network(network_file)
+    for site in (origin, destination):
+        if traffic_network.get_node_from_scats_number(int(site)) is None:
+            raise ValueError(f"Invalid SCATS Number: {site}")
+    if end < start or interval <= 0:
+        raise ValueError(f"Invalid departure window: {start} - {end} every {interval} minutes")
+    if end - start > MAX_SWEEP_WINDOW:
+        raise ValueError(f"The departure window can be at most {MAX_SWEEP_WINDOW.total_seconds() / 3600:g} hours")
+    if (end - start) // datetime.timedelta(minutes=interval) + 1 > MAX_SWEEP_DEPARTURES:
+        raise ValueError(f"At most {MAX_SWEEP_DEPARTURES} departures can be swept at once, use a longer interval")
+
+    departures = []
+    departure = start
+    while departure <= end:
+        departures.append(departure)
+        departure += datetime.timedelta(minutes=interval)
+
+    if prediction_cache is None:
+        prediction_cache = PredictionCache()
+
+    routes = []
+    seen = set()
+    for departure in dict.fromkeys((departures[0], departures[len(departures) // 2], departures[-1])):
+        for route in router.find_routes(traffic_network, int(origin), int(destination), departure, model_type, route_options_count, prediction_cache):
+            if tuple(route.list_scats()) not in seen:
+                seen.add(tuple(route.list_scats()))
+                routes.append(route)
+
+    return routes, departures, router.retime_routes(traffic_network, routes, departures, model_type, prediction_cache)
+
+def _find_routes(traffic_network, query: tuple, route_options_count: int, prediction_cache: PredictionCache) -> list:
+    origin, destination, date, model_type = query
+    for site in (origin, destination):
+        if traffic_network.get_node_from_scats_number(site) is None:
+            raise ValueError(f"Invalid SCATS Number: {site}")
+    return router.find_routes(traffic_network, origin, destination, date, model_type, route_options_count, prediction_cache)
+
+# route many (origin, destination, date, model) queries at once
+# repeated queries are only searched once and the searches run on a bounded pool of threads which share the
+# loaded network and one prediction cache, returns a (routes, error) pair for each query in the order given
+def find_routes_batch(queries: list, route_options_count: int = 5, network_file: string = router.TRAFFIC_NETWORK_FILE, max_workers: int = ROUTE_BATCH_WORKERS, prediction_cache: PredictionCache = None) -> list:
+    traffic_network = get_traffic_network(network_file)
+    if prediction_cache is None:
+        prediction_cache = PredictionCache()
+
+    queries = [(int(origin), int(destination), date, model_type) for origin, destination, date, model_type in queries]
+    unique = list(dict.fromkeys(queries))
+    results = {}
+    if len(unique) == 0:
+        return []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(unique))) as pool:
+        futures = {query: pool.submit(_find_routes, traffic_network, query, route_options_count, prediction_cache) for query in unique}
+        for query, future in futures.items():
+            try:
+                results[query] = (future.result(), None)
+            except Exception as e:
+                results[query] = (None, str(e))
+
+    return [results[query] for query in queries]